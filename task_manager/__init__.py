@@ -1 +1,14 @@
-from .task_manager import TaskManager, Task, TaskFailedError, OutputNotAvailableError
+from .task_manager import (
+    TaskManager,
+    Task,
+    TaskFailedError,
+    OutputNotAvailableError,
+    TaskTimeoutError,
+    RunContext,
+    TaskState,
+    RollbackStack,
+    ExecutionPlan,
+)
+from .cache import MemoryCache, DiskCache
+from .journal import Journal
+from .store import SpillStore
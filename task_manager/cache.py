@@ -0,0 +1,394 @@
+"""
+Caches for outputs of tasks registered with cache=True
+"""
+import collections
+import contextlib
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+# Returned by cache lookups when the key is not cached
+MISSING = object()
+
+
+def fingerprint(value: typing.Any) -> typing.Optional[str]:
+    """
+    Returns a content hash of a picklable value or None when
+    the value cannot be pickled.
+    """
+    try:
+        payload = pickle.dumps(value, protocol=4)
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _sizeof(value: typing.Any) -> int:
+    try:
+        return len(pickle.dumps(value, protocol=4))
+    except Exception:  # pylint: disable=broad-except
+        return sys.getsizeof(value)
+
+
+class MemoryCache:
+    """
+    Thread-safe in-memory LRU cache. The least recently used entries are
+    evicted when there are more than max_entries entries or their
+    (pickled) size exceeds max_bytes.
+
+    Usage example:
+
+    tm = TaskManager(cache=MemoryCache(max_entries=100, max_bytes=2**20))
+    """
+
+    def __init__(
+        self,
+        max_entries: typing.Optional[int] = 1024,
+        max_bytes: typing.Optional[int] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        # key -> (value, size)
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: typing.Any = MISSING) -> typing.Any:
+        """
+        Returns the cached value and marks it as recently used
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: typing.Any):
+        """
+        Caches a value, evicting least recently used values if needed
+        """
+        size = _sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._is_full():
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def _is_full(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._size > self.max_bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    @property
+    def size(self) -> int:
+        """
+        total size of the cached values in bytes
+        """
+        return self._size
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._size,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+
+class DiskCache:
+    """
+    Cache stored in a directory and shared by all processes using it:
+    values are pickled into blob files (written atomically) which are
+    indexed in a SQLite database. Entries expire after ttl seconds and
+    the least recently used entries are evicted when there are more than
+    max_entries entries or the blobs exceed max_bytes.
+
+    Every thread opens its own connection to the index, close() (or
+    leaving a with block) closes them.
+
+    Usage example:
+
+    with DiskCache("/var/cache/my-tasks", ttl=3600) as cache:
+        tm = TaskManager(cache=cache)
+        ...
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: typing.Optional[float] = None,
+        max_entries: typing.Optional[int] = None,
+        max_bytes: typing.Optional[int] = None,
+        timeout: float = 30.0,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._timeout = timeout
+        self._blob_directory = os.path.join(self.directory, "blobs")
+        os.makedirs(self._blob_directory, exist_ok=True)
+        self._local = threading.local()
+        # (process id, connection) of every connection opened
+        self._connections: typing.List[typing.Tuple[int, sqlite3.Connection]] = []
+        self._lock = threading.Lock()
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " filename TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " expires REAL,"
+                " accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Returns a connection owned by the current thread and process
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            # used by the current thread only but closed by close()
+            connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"),
+                timeout=self._timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+            with self._lock:
+                self._connections.append((self._local.pid, connection))
+        return connection
+
+    def close(self):
+        """
+        Closes the connections of all threads of this process, must not be
+        called while other threads use the cache. Using the cache again
+        opens new connections.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        pid = os.getpid()
+        for owner, connection in connections:
+            # connections inherited from a parent process belong to it
+            if owner == pid:
+                connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self._blob_directory, filename[:2], filename)
+
+    def _remove_blob(self, filename: str):
+        try:
+            os.remove(self._path(filename))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str, default: typing.Any = MISSING) -> typing.Any:
+        """
+        Returns the cached value unless it is missing or expired
+        """
+        now = time.time()
+        row = (
+            self._connection()
+            .execute("SELECT filename, expires FROM entries WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is not None and (row[1] is None or row[1] > now):
+            try:
+                with open(self._path(row[0]), "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                # removed by another process in the meantime
+                value = MISSING
+            if value is not MISSING:
+                self._connection().execute(
+                    "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+                )
+                self.hits += 1
+                return value
+        if row is not None:
+            self._delete(key)
+        self.misses += 1
+        return default
+
+    def set(self, key: str, value: typing.Any):
+        """
+        Caches a picklable value, unpicklable values are ignored
+        """
+        try:
+            payload = pickle.dumps(value, protocol=4)
+        except Exception:  # pylint: disable=broad-except
+            return
+        if self.max_bytes is not None and len(payload) > self.max_bytes:
+            return
+        filename = hashlib.sha256(key.encode()).hexdigest()
+        path = self._path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        now = time.time()
+        expires = None if self.ttl is None else now + self.ttl
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries"
+                " (key, filename, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, filename, len(payload), expires, now),
+            )
+            self._evict(connection, now)
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """
+        Removes expired and least recently used entries within a transaction
+        """
+        evicted = connection.execute(
+            "SELECT key, filename FROM entries"
+            " WHERE expires IS NOT NULL AND expires <= ?",
+            (now,),
+        ).fetchall()
+        count, size = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            " WHERE expires IS NULL OR expires > ?",
+            (now,),
+        ).fetchone()
+        if (self.max_entries is not None and count > self.max_entries) or (
+            self.max_bytes is not None and size > self.max_bytes
+        ):
+            for key, filename, entry_size in connection.execute(
+                "SELECT key, filename, size FROM entries"
+                " WHERE expires IS NULL OR expires > ? ORDER BY accessed",
+                (now,),
+            ).fetchall():
+                evicted.append((key, filename))
+                count -= 1
+                size -= entry_size
+                self.evictions += 1
+                if (self.max_entries is None or count <= self.max_entries) and (
+                    self.max_bytes is None or size <= self.max_bytes
+                ):
+                    break
+        connection.executemany(
+            "DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted]
+        )
+        for _, filename in evicted:
+            self._remove_blob(filename)
+
+    def _delete(self, key: str):
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT filename FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        if row is not None:
+            self._remove_blob(row[0])
+
+    def clear(self):
+        with self._transaction() as connection:
+            filenames = connection.execute("SELECT filename FROM entries").fetchall()
+            connection.execute("DELETE FROM entries")
+        for (filename,) in filenames:
+            self._remove_blob(filename)
+
+    @property
+    def size(self) -> int:
+        """
+        total size of the cached values in bytes
+        """
+        return (
+            self._connection()
+            .execute("SELECT COALESCE(SUM(size), 0) FROM entries")
+            .fetchone()[0]
+        )
+
+    def stats(self) -> typing.Dict[str, int]:
+        entries, size = (
+            self._connection()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+            .fetchone()
+        )
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, key) -> bool:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT 1 FROM entries"
+                " WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row is not None
@@ -0,0 +1,139 @@
+"""
+Write-ahead journal of task completions used to resume interrupted runs
+"""
+import base64
+import json
+import os
+import pickle
+import threading
+import typing
+
+MODE_SEQUENTIAL = "sequential"
+MODE_PARALLEL = "parallel"
+MODE_ASYNC = "async"
+
+
+class JournalEntry:
+    """
+    Contents of the journal of a single run
+    """
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        # (mode, task names) of every run_tasks call in the run
+        self.runs: typing.List[typing.Tuple[str, typing.List[str]]] = []
+        # outputs of succeeded tasks in the order they completed
+        self.outputs: typing.Dict[str, typing.Any] = {}
+        self.rolled_back = False
+        # whether every run_tasks call journaled so far has finished
+        self.completed = False
+
+
+class Journal:
+    """
+    Appends a record to <directory>/<run_id>.journal whenever a run
+    starts, a task succeeds or a run is rolled back. Outputs are pickled
+    into the record, tasks with unpicklable outputs are run again when
+    the run is resumed. Records are flushed to disk (fsync) before the
+    run continues unless fsync=False.
+
+    Once a run_tasks call has succeeded or has been rolled back there is
+    nothing left to resume and the journal of the run is deleted. With
+    keep_completed=True a completion record is appended instead and the
+    file is kept, e.g. for auditing; such journals are never removed by
+    the task manager.
+
+    Usage example:
+
+    tm = TaskManager(journal=Journal("/var/lib/my-tasks"))
+    context = tm.new_context()
+    try:
+        context.run_tasks(["task1", "task2", "task3"])
+    finally:
+        print(context.run_id)
+
+    # after a crash, in a new process
+    tm.resume(run_id)
+    """
+
+    def __init__(self, directory: str, fsync=True, keep_completed=False):
+        self.directory = os.path.abspath(directory)
+        self._fsync = fsync
+        self.keep_completed = keep_completed
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, run_id: str) -> str:
+        if not run_id or os.sep in run_id or run_id.startswith("."):
+            raise ValueError(f"Invalid run id '{run_id}'")
+        return os.path.join(self.directory, f"{run_id}.journal")
+
+    def _append(self, run_id: str, record: typing.Dict[str, typing.Any]):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path(run_id), "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                if self._fsync:
+                    os.fsync(f.fileno())
+
+    def record_start(self, run_id: str, mode: str, tasks: typing.Iterable[str]):
+        self._append(run_id, {"type": "start", "mode": mode, "tasks": list(tasks)})
+
+    def record_success(self, run_id: str, task_name: str, output: typing.Any):
+        try:
+            payload: typing.Optional[str] = base64.b64encode(
+                pickle.dumps(output, protocol=4)
+            ).decode("ascii")
+        except Exception:  # pylint: disable=broad-except
+            payload = None
+        self._append(run_id, {"type": "success", "task": task_name, "output": payload})
+
+    def record_rollback(self, run_id: str):
+        self._append(run_id, {"type": "rollback"})
+
+    def record_complete(self, run_id: str):
+        """
+        Records that the journaled runs have succeeded or have been
+        rolled back: deletes the journal unless keep_completed=True
+        """
+        if self.keep_completed:
+            self._append(run_id, {"type": "complete"})
+        else:
+            self.delete(run_id)
+
+    def load(self, run_id: str) -> JournalEntry:
+        """
+        Reads the journal of a run. A partially written last record
+        (crash while writing) is ignored.
+
+        Raises:
+            FileNotFoundError when there is no journal for the run
+        """
+        entry = JournalEntry(run_id)
+        with open(self.path(run_id), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record["type"] == "start":
+                    run = (record["mode"], record["tasks"])
+                    if run not in entry.runs:
+                        entry.runs.append(run)
+                    entry.completed = False
+                elif record["type"] == "success" and record["output"] is not None:
+                    entry.outputs[record["task"]] = pickle.loads(
+                        base64.b64decode(record["output"])
+                    )
+                elif record["type"] == "rollback":
+                    entry.rolled_back = True
+                elif record["type"] == "complete":
+                    entry.completed = True
+        return entry
+
+    def delete(self, run_id: str):
+        try:
+            os.remove(self.path(run_id))
+        except FileNotFoundError:
+            pass
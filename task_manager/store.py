@@ -0,0 +1,361 @@
+"""
+Spilling of task outputs to memory-mapped files and handing them to
+worker processes through shared memory
+"""
+import array
+import mmap
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import typing
+import uuid
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7
+    shared_memory = None  # type: ignore[assignment]
+
+
+# items of a container sizeof() looks at
+_SIZEOF_SAMPLE = 64
+
+
+def _shallow_sizeof(value: typing.Any) -> int:
+    """
+    sys.getsizeof() of a value or the size of its buffer (memoryview,
+    NumPy arrays, ...) when it is larger
+    """
+    size = sys.getsizeof(value)
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is None and not isinstance(value, (str, bytes, bytearray)):
+        try:
+            nbytes = memoryview(value).nbytes
+        except TypeError:
+            nbytes = 0
+    return max(size, nbytes or 0)
+
+
+def sizeof(value: typing.Any) -> int:
+    """
+    Estimates the memory used by a value in bytes in constant time: the
+    shallow size of the value (see _shallow_sizeof()) plus, for lists,
+    tuples, sets, dicts and objects, the shallow sizes of their first
+    items (attributes) extrapolated to all items. Nested containers
+    are not walked.
+    """
+    size = _shallow_sizeof(value)
+    if isinstance(value, dict):
+        items: typing.Collection[typing.Any] = value
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = value
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        items = vars(value)
+        size += sys.getsizeof(items)
+    else:
+        return size
+    if not items:
+        return size
+    sampled = 0
+    count = 0
+    for item in items:
+        sampled += _shallow_sizeof(item)
+        if isinstance(items, dict):
+            sampled += _shallow_sizeof(items[item])
+        count += 1
+        if count == _SIZEOF_SAMPLE:
+            break
+    return size + sampled * len(items) // count
+
+
+class SpilledOutput:
+    """
+    Handle of an output written to a file by SpillStore.spill()
+    """
+
+    __slots__ = ("path", "size", "_pickle_size", "_buffer_sizes", "_store")
+
+    def __init__(
+        self,
+        store: "SpillStore",
+        path: str,
+        pickle_size: int,
+        buffer_sizes: typing.List[int],
+    ):
+        self._store = store
+        self.path = path
+        self._pickle_size = pickle_size
+        self._buffer_sizes = buffer_sizes
+        # size of the file in bytes
+        self.size = pickle_size + sum(buffer_sizes)
+
+    def load(self) -> typing.Any:
+        """
+        Maps the file into memory and unpickles the output. Out-of-band
+        buffers (bytearray, NumPy arrays, ...) are views of the mapping
+        instead of copies, the operating system pages them in on access.
+        """
+        with open(self.path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        buffers = []
+        offset = self._pickle_size
+        for size in self._buffer_sizes:
+            buffers.append(view[offset : offset + size])
+            offset += size
+        self._store.loads += 1
+        if not buffers:
+            return pickle.loads(view[: self._pickle_size])
+        return pickle.loads(view[: self._pickle_size], buffers=buffers)
+
+    def delete(self):
+        self._store.remove(self)
+
+
+class SpillStore:
+    """
+    Writes outputs to files in directory (a new temporary directory by
+    default) when the outputs kept by a run context exceed max_bytes.
+    The largest outputs are spilled first and read back from the
+    memory-mapped file whenever get_output_for() asks for them. Spilled
+    files are removed when the output is released or the context flushed.
+
+    Usage example:
+
+    tm = TaskManager(spill=SpillStore(max_bytes=2**30))
+    """
+
+    def __init__(self, max_bytes: int, directory: typing.Optional[str] = None):
+        self.max_bytes = max_bytes
+        self._temporary = directory is None
+        self.directory = os.path.abspath(
+            tempfile.mkdtemp(prefix="task-manager-") if directory is None else directory
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self.spills = 0
+        self.loads = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def spill(self, value: typing.Any) -> typing.Optional[SpilledOutput]:
+        """
+        Writes a picklable value to a new file, buffers supporting pickle
+        protocol 5 out-of-band. Returns None when the value cannot be pickled.
+        """
+        buffers: typing.List[typing.Any] = []
+        try:
+            if pickle.HIGHEST_PROTOCOL < 5:
+                payload, raw = pickle.dumps(value, protocol=4), []
+            else:
+                payload = pickle.dumps(
+                    value, protocol=5, buffer_callback=buffers.append
+                )
+                raw = [buffer.raw() for buffer in buffers]
+        except BufferError:
+            # non-contiguous buffers are pickled in-band
+            payload, raw = pickle.dumps(value, protocol=5), []
+        except Exception:  # pylint: disable=broad-except
+            return None
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.spill")
+        with open(path, "wb") as f:
+            f.write(payload)
+            for buffer in raw:
+                f.write(buffer)
+        spilled = SpilledOutput(self, path, len(payload), [b.nbytes for b in raw])
+        with self._lock:
+            self.spills += 1
+            self._bytes += spilled.size
+        return spilled
+
+    def remove(self, spilled: SpilledOutput):
+        """
+        Removes the file of a spilled output
+        """
+        try:
+            os.remove(spilled.path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._bytes -= spilled.size
+
+    @property
+    def size(self) -> int:
+        """
+        total size of the spilled files in bytes
+        """
+        return self._bytes
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {"spills": self.spills, "loads": self.loads, "bytes": self._bytes}
+
+    def close(self):
+        """
+        Removes the directory if the store created it
+        """
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SharedOutput:
+    """
+    Picklable handle of an output whose large buffers were copied into
+    shared memory segments by share(). Sending the handle to a worker
+    process only pickles the small in-band part, load() in the worker
+    unpickles the buffers as views of the segments (zero-copy for NumPy
+    arrays and other types supporting pickle protocol 5). bytes and
+    array.array outputs, which own their memory, are copied once from
+    the segment instead.
+    """
+
+    def __init__(
+        self,
+        payload: bytes,
+        segments: typing.List[typing.Tuple[str, int]],
+        typecode: typing.Optional[str] = None,
+    ):
+        self.payload = payload
+        # (segment name, buffer size) of every out-of-band buffer
+        self.segments = segments
+        # "bytes" or the array.array typecode of an output which is
+        # a single buffer, None for pickled outputs
+        self.typecode = typecode
+        self._attached: typing.List[typing.Any] = []
+
+    def __getstate__(self):
+        return (self.payload, self.segments, self.typecode)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def load(self) -> typing.Any:
+        """
+        Attaches the segments and unpickles the output. The segments stay
+        attached until close() is called, which has to be done once the
+        output is not used anymore.
+        """
+        buffers = []
+        for name, size in self.segments:
+            segment = _attach(name)
+            # views of the segment must not outlive the mapping
+            self._attached.append(segment)
+            buffers.append(segment.buf[:size])
+        if self.typecode == "bytes":
+            return bytes(buffers[0])
+        if self.typecode is not None:
+            output = array.array(self.typecode)
+            output.frombytes(buffers[0])
+            return output
+        return pickle.loads(self.payload, buffers=buffers)
+
+    def close(self):
+        attached, self._attached = self._attached, []
+        close_attached(attached)
+
+
+def _attach(name: str):
+    """
+    Attaches to a segment owned by another process
+    """
+    if sys.version_info >= (3, 13):
+        # pylint: disable-next=unexpected-keyword-arg
+        return shared_memory.SharedMemory(name=name, track=False)
+    # before Python 3.13 attaching registers the segment with the
+    # resource tracker, which worker processes share with the process
+    # owning the segment, so the registration has no effect
+    return shared_memory.SharedMemory(name=name)
+
+
+# Segments attached by this process whose closing failed because views
+# of them were still in use, closing them is retried by close_attached()
+_unclosed: typing.List[typing.Any] = []
+_unclosed_lock = threading.Lock()
+
+
+def close_attached(segments: typing.Iterable[typing.Any] = ()):
+    """
+    Closes segments attached by SharedOutput.load() and the segments
+    which could not be closed before. Segments still exported to views
+    (e.g. by a NumPy array which outlived the task) stay open until
+    a later call.
+    """
+    with _unclosed_lock:
+        _unclosed.extend(segments)
+        still_open = []
+        for segment in _unclosed:
+            try:
+                segment.close()
+            except BufferError:
+                still_open.append(segment)
+        _unclosed[:] = still_open
+
+
+def share(
+    value: typing.Any, min_bytes: int
+) -> typing.Tuple[typing.Any, typing.List[typing.Any]]:
+    """
+    Copies the buffers of a value which are at least min_bytes large into
+    new shared memory segments.
+
+    Returns:
+        (SharedOutput, segments) or (value, []) when the value has no such
+        buffers or cannot be shared. The caller owns the segments and has
+        to close and unlink them.
+    """
+    if shared_memory is None:
+        return value, []
+    if isinstance(value, (bytes, array.array)):
+        raw = memoryview(value).cast("B")
+        if raw.nbytes < min_bytes:
+            return value, []
+        typecode = "bytes" if isinstance(value, bytes) else value.typecode
+        segments = _copy_to_segments([raw])
+        return SharedOutput(b"", [(segments[0].name, raw.nbytes)], typecode), segments
+    buffers: typing.List[memoryview] = []
+
+    def out_of_band(buffer: pickle.PickleBuffer) -> bool:
+        raw = buffer.raw()
+        if raw.nbytes < min_bytes:
+            return True
+        buffers.append(raw)
+        return False
+
+    try:
+        payload = pickle.dumps(value, protocol=5, buffer_callback=out_of_band)
+    except Exception:  # pylint: disable=broad-except
+        return value, []
+    if not buffers:
+        return value, []
+    segments = _copy_to_segments(buffers)
+    return (
+        SharedOutput(
+            payload, [(s.name, raw.nbytes) for s, raw in zip(segments, buffers)]
+        ),
+        segments,
+    )
+
+
+def _copy_to_segments(buffers: typing.List[memoryview]) -> typing.List[typing.Any]:
+    segments: typing.List[typing.Any] = []
+    try:
+        for raw in buffers:
+            segment = shared_memory.SharedMemory(create=True, size=max(raw.nbytes, 1))
+            segments.append(segment)
+            typing.cast(memoryview, segment.buf)[: raw.nbytes] = raw
+    except BaseException:
+        release_segments(segments)
+        raise
+    return segments
+
+
+def release_segments(segments: typing.Iterable[typing.Any]):
+    """
+    Closes and unlinks segments created by share()
+    """
+    for segment in segments:
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
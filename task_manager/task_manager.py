@@ -1,30 +1,782 @@
 """
 Library for safe and easy execution of functions
 """  # pylint: disable=too-many-lines
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import multiprocessing
+import os
+import threading
+import time
 import typing
+import uuid
+
+from .cache import MISSING, MemoryCache, fingerprint
+from .journal import MODE_ASYNC, MODE_PARALLEL, MODE_SEQUENTIAL, Journal
+from .store import (
+    SharedOutput,
+    SpilledOutput,
+    SpillStore,
+    release_segments,
+    share,
+    sizeof,
+)
+
+# Where a task is executed by run_tasks_parallel() and run_tasks_async(),
+# run_tasks() and compiled plans wait for process tasks and run the rest
+# in the calling thread
+EXECUTOR_INLINE = "inline"
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+EXECUTORS = (EXECUTOR_INLINE, EXECUTOR_THREAD, EXECUTOR_PROCESS)
+
+# Task run by the current asyncio task in run_tasks_async()
+_current_async_task: "contextvars.ContextVar[typing.Optional[str]]" = (
+    contextvars.ContextVar("current_async_task", default=None)
+)
+
+
+class TaskTiming(typing.NamedTuple):
+    """
+    Timing of a single execution of a task. started and finished are
+    time.perf_counter() timestamps, cpu is the CPU time spent by the
+    executing thread (the worker process for process tasks) or None for
+    coroutines, which share their thread with other tasks.
+    """
+
+    started: float
+    finished: float
+    cpu: typing.Optional[float]
+    thread_id: int
+    process_id: int
+
+    @property
+    def wall(self) -> float:
+        return self.finished - self.started
+
+
+def _finish_timing(started: float, cpu_started: float) -> TaskTiming:
+    return TaskTiming(
+        started,
+        time.perf_counter(),
+        time.thread_time() - cpu_started,
+        threading.get_ident(),
+        os.getpid(),
+    )
+
+
+def _call_timed(
+    action: typing.Callable, kwargs: typing.Dict[str, typing.Any]
+) -> typing.Tuple[typing.Any, TaskTiming]:
+    """
+    Calls action in a worker process and returns its output and timing.
+    Outputs handed over in shared memory are closed once action returned.
+    """
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        output = action(**kwargs)
+    finally:
+        get_output_for = kwargs.get("get_output_for")
+        if isinstance(get_output_for, _ResolvedOutputs):
+            get_output_for.close()
+    return output, TaskTiming(
+        started,
+        time.perf_counter(),
+        time.process_time() - cpu_started,
+        threading.get_ident(),
+        os.getpid(),
+    )
+
+
+def _process_context() -> typing.Any:
+    """
+    Returns the multiprocessing context task processes are started with.
+    Forking the threads of a run may deadlock the child, forkserver is
+    used where it is available and spawn elsewhere.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _send_result(
+    connection, action: typing.Callable, kwargs: typing.Dict[str, typing.Any]
+):
+    """
+    Calls action in a dedicated process and sends (True, (output, timing))
+    or (False, exception) to the parent
+    """
+    try:
+        try:
+            result: typing.Tuple[bool, typing.Any] = (True, _call_timed(action, kwargs))
+        except Exception as e:  # pylint: disable=broad-except
+            result = (False, e)
+        try:
+            connection.send(result)
+        except Exception as e:  # pylint: disable=broad-except
+            connection.send((False, RuntimeError(f"Result cannot be sent: {e!r}")))
+    finally:
+        connection.close()
+
+
+def _call_in_process(
+    action: typing.Callable,
+    kwargs: typing.Dict[str, typing.Any],
+    task_name: str,
+    timeout: float,
+) -> typing.Tuple[typing.Any, TaskTiming]:
+    """
+    Calls action in a new process like _call_timed(). The process is
+    terminated when it does not finish within timeout seconds.
+
+    Raises:
+        Re-raises the original exception
+        TaskTimeoutError when the timeout expired
+    """
+    if timeout <= 0:
+        raise TaskTimeoutError(f"Task '{task_name}' not started, deadline passed")
+    context = _process_context()
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_send_result, args=(sender, action, kwargs), daemon=True
+    )
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise TaskTimeoutError(
+                f"Task '{task_name}' timed out after {timeout:.3g} seconds"
+            )
+        succeeded, result = receiver.recv()
+    except EOFError as e:
+        raise RuntimeError(
+            f"Process of task '{task_name}' exited without a result"
+        ) from e
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+    if not succeeded:
+        raise result
+    return result
+
+
+def _call_with_timeout(
+    action: typing.Callable,
+    kwargs: typing.Dict[str, typing.Any],
+    task_name: str,
+    timeout: float,
+) -> typing.Tuple[typing.Any, float]:
+    """
+    Calls action in a new daemon thread and waits at most timeout seconds
+    for it. Threads cannot be stopped, a call which timed out keeps running
+    in the background and its output is discarded. Returns the output and
+    the CPU time of the thread.
+
+    Raises:
+        Re-raises the original exception
+        TaskTimeoutError when the timeout expired
+    """
+    if timeout <= 0:
+        raise TaskTimeoutError(f"Task '{task_name}' not started, deadline passed")
+    result: typing.List[typing.Tuple[bool, typing.Any, float]] = []
+
+    def call():
+        cpu_started = time.thread_time()
+        try:
+            output = action(**kwargs)
+        except BaseException as e:  # pylint: disable=broad-except
+            result.append((False, e, time.thread_time() - cpu_started))
+        else:
+            result.append((True, output, time.thread_time() - cpu_started))
+
+    thread = threading.Thread(target=call, name=f"task-{task_name}", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not result:
+        raise TaskTimeoutError(
+            f"Task '{task_name}' timed out after {timeout:.3g} seconds"
+        )
+    succeeded, output, cpu = result[0]
+    if not succeeded:
+        raise output
+    return output, cpu
+
+
+def _time_limited(
+    action: typing.Callable,
+    task_name: str,
+    timeout: float,
+    on_cpu: typing.Optional[typing.Callable[[float], typing.Any]] = None,
+) -> typing.Callable:
+    """
+    Wraps action so it raises TaskTimeoutError after timeout seconds.
+    Coroutines are cancelled, synchronous actions are called with
+    _call_with_timeout() and the CPU time of their thread is passed
+    to on_cpu.
+    """
+    if inspect.iscoroutinefunction(action):
+
+        @functools.wraps(action)
+        async def run_async(**kwargs):
+            if timeout <= 0:
+                raise TaskTimeoutError(
+                    f"Task '{task_name}' not started, deadline passed"
+                )
+            try:
+                return await asyncio.wait_for(action(**kwargs), timeout)
+            except asyncio.TimeoutError as e:
+                raise TaskTimeoutError(
+                    f"Task '{task_name}' timed out after {timeout:.3g} seconds"
+                ) from e
+
+        return run_async
+
+    @functools.wraps(action)
+    def run(**kwargs):
+        output, cpu = _call_with_timeout(action, kwargs, task_name, timeout)
+        if on_cpu is not None:
+            on_cpu(cpu)
+        return output
+
+    return run
+
+
+# TaskState._status values
+_NOT_RUN = 0
+_SUCCEEDED = 1
+_FAILED = 2
+# succeeded, output released after its consumers finished
+_RELEASED = 3
+# succeeded, output spilled to a file (see SpillStore)
+_SPILLED = 4
+# TaskState.is_success() per status
+_SUCCESS_BY_STATUS = (None, True, False, True, True)
+
+# Task._flags bits
+_USES_OUTPUT = 1
+_ROLLBACK_USES_OUTPUT = 2
+_USES_CACHE = 4
+_RETAIN_OUTPUT = 8
+_BATCHABLE = 16
+_SINGLE_FLIGHT = 32
+
+
+class _Epoch:
+    """
+    Generation counter shared by the states of a run context. Flushing
+    the context starts a new generation, states written in an older
+    generation are flushed when they are accessed next.
+    """
+
+    __slots__ = ("generation",)
+
+    def __init__(self):
+        self.generation = 0
+
+
+# Epoch of states which are not part of a run context, never advanced
+_DETACHED = _Epoch()
+
+
+class TaskState:
+    """
+    Status, input and output of a task within a single run
+    """
+
+    __slots__ = (
+        "_status",
+        "_output",
+        "_input",
+        "_exception",
+        "_timing",
+        "_epoch",
+        "_generation",
+    )
+
+    def __init__(self, epoch: typing.Optional[_Epoch] = None):
+        self._status = _NOT_RUN
+        # output of the action, a SpilledOutput once spilled
+        self._output: typing.Any = None
+        self._input: typing.Optional[typing.Dict[str, typing.Any]] = None
+        self._exception: typing.Optional[BaseException] = None
+        # TaskTiming of the last execution when the task manager instruments
+        self._timing: typing.Optional[TaskTiming] = None
+        self._epoch = _DETACHED if epoch is None else epoch
+        self._generation = self._epoch.generation
+
+    def _refresh(self):
+        """
+        flushes the state when it was written before its context was flushed
+        """
+        if self._generation != self._epoch.generation:
+            self._output = None
+            self._status = _NOT_RUN
+            self._timing = None
+            self._generation = self._epoch.generation
+
+    def _attach(self, epoch: _Epoch):
+        """
+        makes the state part of the generations of another context
+        """
+        self._refresh()
+        self._epoch = epoch
+        self._generation = epoch.generation
+
+    def copy(self) -> "TaskState":
+        """
+        returns a copy of the state
+        """
+        self._refresh()
+        return TaskState._detached(
+            self._status, self._output, self._input, self._exception, self._timing
+        )
+
+    @classmethod
+    def _detached(cls, status, output, input_, exception, timing) -> "TaskState":
+        """
+        returns a state outside of any run context with the given contents
+        """
+        state = cls()
+        state._status = status
+        state._output = output
+        state._input = input_
+        state._exception = exception
+        state._timing = timing
+        return state
+
+    def flush(self):
+        """flushes outputs and statuses"""
+        self._output = None
+        self._status = _NOT_RUN
+        self._timing = None
+        self._generation = self._epoch.generation
+
+    @property
+    def timing(self) -> typing.Optional[TaskTiming]:
+        self._refresh()
+        return self._timing
+
+    @timing.setter
+    def timing(self, timing: typing.Optional[TaskTiming]):
+        self._refresh()
+        self._timing = timing
+
+    def run(self, action: typing.Callable, **kwargs):
+        """
+        runs action and save the output
+
+        Raises:
+            Re-raises the original exception
+        """
+        self._refresh()
+        try:
+            # save keyword arguments (input)
+            self._input = kwargs
+            # run task function/action and save output
+            self._output = action(**kwargs)
+            self._status = _SUCCEEDED
+        except Exception as e:
+            self._exception = e
+            self._status = _FAILED
+            raise
+
+    async def run_async(self, action: typing.Callable, **kwargs):
+        """
+        runs action and save the output like run() but awaits the output
+        when the action is a coroutine function.
+
+        Raises:
+            Re-raises the original exception
+        """
+        self._refresh()
+        try:
+            self._input = kwargs
+            output = action(**kwargs)
+            if inspect.isawaitable(output):
+                output = await output
+            self._output = output
+            self._status = _SUCCEEDED
+        except Exception as e:
+            self._exception = e
+            self._status = _FAILED
+            raise
+
+    def record_result(
+        self,
+        kwargs: typing.Dict[str, typing.Any],
+        output: typing.Any = None,
+        exception: typing.Optional[BaseException] = None,
+    ):
+        """
+        saves the result of the action when it was executed outside
+        of run(), e.g. in a worker process
+        """
+        self._refresh()
+        self._input = kwargs
+        if exception is not None:
+            self._exception = exception
+            self._status = _FAILED
+            return
+        self._output = output
+        self._status = _SUCCEEDED
+
+    def get_output(self) -> typing.Any:
+        if self._generation != self._epoch.generation:
+            self._refresh()
+        if self._status == _SPILLED:
+            return self._output.load()
+        return self._output
+
+    def has_run(self):
+        if self._generation != self._epoch.generation:
+            self._refresh()
+        return self._status != _NOT_RUN
+
+    def release(self):
+        """
+        drops the output of a succeeded task to free its memory
+        """
+        self._refresh()
+        if self._status in (_SUCCEEDED, _SPILLED):
+            self._output = None
+            self._status = _RELEASED
+
+    def spill(self, spilled: SpilledOutput):
+        """
+        replaces the output of a succeeded task by the file it was
+        written to, get_output() reads it from there
+        """
+        self._refresh()
+        if self._status == _SUCCEEDED:
+            self._output = spilled
+            self._status = _SPILLED
+
+    def is_released(self):
+        if self._generation != self._epoch.generation:
+            self._refresh()
+        return self._status == _RELEASED
+
+    def is_success(self):
+        if self._generation != self._epoch.generation:
+            self._refresh()
+        return _SUCCESS_BY_STATUS[self._status]
+
+    def get_input(self):
+        return self._input
+
+    def get_exception(self):
+        return self._exception
+
+
+class _Batch:
+    """
+    Calls of a batchable task collected while the batch is open
+    """
+
+    __slots__ = ("items", "full", "done", "outputs", "exception")
+
+    def __init__(self):
+        self.items: typing.List[typing.Dict[str, typing.Any]] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.outputs: typing.List[typing.Any] = []
+        self.exception: typing.Optional[BaseException] = None
+
+
+class _Batcher:
+    """
+    Stands in for the action of a task registered with batchable=True.
+    Calls made by concurrent runs within window seconds (at most max_size)
+    are coalesced into a single call of the function with the list of
+    their keyword arguments. The function returns a list of outputs in
+    the same order, output i is returned to call i. An exception instance
+    in the list is raised for its call only, so one bad input does not
+    fail the other runs. The first call of a batch waits for the window
+    and calls the function, an exception raised by the function fails
+    every call of the batch.
+    """
+
+    __name__: str
+
+    def __init__(self, function: typing.Callable, max_size: int, window: float):
+        if max_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        functools.update_wrapper(self, function)
+        self._function = function
+        self._max_size = max_size
+        self._window = window
+        self._lock = threading.Lock()
+        self._open: typing.Optional[_Batch] = None
+        # number of calls of the function
+        self.batches = 0
+
+    def __call__(self, **kwargs) -> typing.Any:
+        with self._lock:
+            batch = self._open
+            first = batch is None
+            if batch is None:
+                batch = self._open = _Batch()
+            index = len(batch.items)
+            batch.items.append(kwargs)
+            if index + 1 >= self._max_size:
+                self._open = None
+                batch.full.set()
+        if first:
+            batch.full.wait(self._window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run(batch)
+        else:
+            batch.done.wait()
+        if batch.exception is not None:
+            raise batch.exception
+        output = batch.outputs[index]
+        if isinstance(output, Exception):
+            raise output
+        return output
+
+    def _run(self, batch: _Batch):
+        with self._lock:
+            self.batches += 1
+        try:
+            outputs = list(self._function(batch.items))
+            if len(outputs) != len(batch.items):
+                raise ValueError(
+                    f"Batchable task '{self.__name__}' returned {len(outputs)}"
+                    f" outputs for {len(batch.items)} inputs"
+                )
+            batch.outputs = outputs
+        except Exception as e:  # pylint: disable=broad-except
+            batch.exception = e
+        finally:
+            batch.done.set()
+
+
+class _SingleFlight:
+    """
+    Calls of a task with single_flight=True in progress by key
+    """
+
+    def __init__(self):
+        self._calls: typing.Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        # number of calls which shared the result of another call
+        self.shared = 0
+
+    def join(self, key: str) -> typing.Tuple[concurrent.futures.Future, bool]:
+        """
+        Returns the future of the call in progress with the same key, or
+        a new one and True when the caller has to make the call
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = self._calls[key] = concurrent.futures.Future()
+            return future, True
+
+    def finish(
+        self,
+        key: str,
+        future: concurrent.futures.Future,
+        output: typing.Any = None,
+        exception: typing.Optional[BaseException] = None,
+    ):
+        with self._lock:
+            del self._calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(output)
+
+
+def _single_flight(
+    function: typing.Callable, depends_on: typing.Tuple[str, ...]
+) -> typing.Callable:
+    """
+    Wraps the action of a task registered with single_flight=True: a call
+    with the same input and the same outputs of the depends_on tasks as a
+    call in progress (in any run) waits for it and returns its output or
+    raises its exception instead of calling the function again. Calls
+    whose input cannot be pickled are always made.
+    """
+    flights = _SingleFlight()
+
+    def key_for(kwargs: typing.Dict[str, typing.Any], outputs) -> typing.Optional[str]:
+        inputs = sorted((k, v) for k, v in kwargs.items() if k != "get_output_for")
+        return fingerprint((function.__name__, inputs, outputs))
+
+    def outputs_for(kwargs: typing.Dict[str, typing.Any]):
+        get_output_for = kwargs.get("get_output_for")
+        return [get_output_for(t) for t in depends_on] if get_output_for else []
+
+    if inspect.iscoroutinefunction(function):
+
+        @functools.wraps(function)
+        async def run_async(**kwargs):
+            outputs = []
+            for output in outputs_for(kwargs):
+                outputs.append(await output if inspect.isawaitable(output) else output)
+            key = key_for(kwargs, outputs)
+            if key is None:
+                return await function(**kwargs)
+            future, first = flights.join(key)
+            if not first:
+                return await asyncio.wrap_future(future)
+            try:
+                output = await function(**kwargs)
+            except BaseException as e:
+                flights.finish(key, future, exception=e)
+                raise
+            flights.finish(key, future, output)
+            return output
+
+        run_async.flights = flights  # type: ignore[attr-defined]
+        return run_async
+
+    @functools.wraps(function)
+    def run(**kwargs):
+        key = key_for(kwargs, outputs_for(kwargs))
+        if key is None:
+            return function(**kwargs)
+        future, first = flights.join(key)
+        if not first:
+            return future.result()
+        try:
+            output = function(**kwargs)
+        except BaseException as e:
+            flights.finish(key, future, exception=e)
+            raise
+        flights.finish(key, future, output)
+        return output
+
+    run.flights = flights  # type: ignore[attr-defined]
+    return run
 
 
 class Task:
     """
-    Task object containing function and its output
+    Task object containing function and its output.
+
+    The status and output of the task are kept in a TaskState. Methods
+    like has_run() and get_output() read the state of the task manager's
+    default run context (see RunContext).
     """
 
+    __slots__ = (
+        "_action",
+        "rollback",
+        "_flags",
+        "_depends_on",
+        "_executor",
+        "_timeout",
+        "_state",
+    )
+
     def __init__(
         self,
         action: typing.Optional[typing.Callable],
         rollback: typing.Optional[typing.Callable] = None,
         uses_output=True,
         rollback_uses_output=True,
+        depends_on: typing.Optional[typing.Iterable[str]] = None,
+        executor: typing.Optional[str] = None,
+        cache=False,
+        retain_output=False,
+        batchable=False,
+        batch_size: int = 64,
+        batch_window: float = 0.005,
+        single_flight=False,
+        timeout: typing.Optional[float] = None,
     ):
+        """
+        Arguments:
+            action: Callable - function run by the task
+            rollback: Callable - function run when a later task fails
+            uses_output: bool - action receives get_output_for
+            rollback_uses_output: bool - rollback receives get_output_for
+            depends_on: Iterable[str] - tasks which have to succeed first
+                in concurrent runs, process tasks only read their outputs
+            executor: str - "inline", "thread" or "process" (see executor())
+            cache: bool - reuses the output of a pure task while its input
+                and the outputs it reads are unchanged
+            retain_output: bool - keeps the output with release_outputs
+            batchable: bool - action receives a list of the keyword
+                arguments of up to batch_size calls made by concurrent runs
+                within batch_window seconds and returns a list of outputs,
+                an exception in the list fails only its own call
+            single_flight: bool - concurrent calls with the same input share
+                the result of the call already in progress
+            timeout: float - seconds the task may run before it fails with
+                TaskTimeoutError; coroutines are cancelled, process tasks
+                terminated and threads abandoned
+
+        Raises:
+            ValueError for an unknown executor or unsupported combination
+        """
+        if executor is not None and executor not in EXECUTORS:
+            raise ValueError(
+                f"Unknown executor '{executor}'. Use one of {', '.join(EXECUTORS)}"
+            )
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+        if batchable:
+            if (
+                action is None
+                or executor == EXECUTOR_PROCESS
+                or inspect.iscoroutinefunction(action)
+            ):
+                raise ValueError(
+                    "Batchable tasks must be synchronous and not run in a process"
+                )
+            action = _Batcher(action, batch_size, batch_window)
+        if single_flight:
+            if action is None or executor == EXECUTOR_PROCESS:
+                raise ValueError(
+                    "Single-flight tasks need an action and cannot run in a process"
+                )
+            action = _single_flight(action, tuple(depends_on or ()))
         self._action = action
-        self._success = None
-        self._has_run = False
-        self._output = None
         self.rollback = rollback
-        self._uses_output = uses_output
-        self._rollback_uses_output = rollback_uses_output
-        self._input = None
-        self._exception = None
+        self._flags = self._pack_flags(
+            uses_output,
+            rollback_uses_output,
+            cache,
+            retain_output,
+            batchable,
+            single_flight,
+        )
+        self._depends_on = tuple(depends_on or ())
+        self._executor = executor
+        self._timeout = timeout
+        self._state = TaskState()
+
+    @staticmethod
+    def _pack_flags(
+        uses_output,
+        rollback_uses_output,
+        cache,
+        retain_output,
+        batchable,
+        single_flight,
+    ) -> int:
+        return (
+            (_USES_OUTPUT if uses_output else 0)
+            | (_ROLLBACK_USES_OUTPUT if rollback_uses_output else 0)
+            | (_USES_CACHE if cache else 0)
+            | (_RETAIN_OUTPUT if retain_output else 0)
+            | (_BATCHABLE if batchable else 0)
+            | (_SINGLE_FLIGHT if single_flight else 0)
+        )
 
     @classmethod
     def make_backup(cls, task):
@@ -32,138 +784,2316 @@ class Task:
         makes a clone/backup of tasks
         """
         backup_task = cls(action=task.action)
-        backup_task._success = task.is_success()
-        backup_task._has_run = task.has_run()
-        backup_task._output = task.get_output()
         backup_task.rollback = task.rollback
-        backup_task._uses_output = task.uses_output()
-        backup_task._rollback_uses_output = task.rollback_uses_output()
-        backup_task._input = task.get_input()
+        # the action of a batchable or single-flight task is wrapped already
+        backup_task._flags = cls._pack_flags(
+            task.uses_output(),
+            task.rollback_uses_output(),
+            task.uses_cache(),
+            task.retains_output(),
+            task.batchable(),
+            task.single_flight(),
+        )
+        backup_task._depends_on = task.depends_on()
+        backup_task._executor = task.executor()
+        backup_task._timeout = task.timeout()
+        backup_task._state = task.state.copy()
         return backup_task
 
     @property
     def action(self):
         return self._action
 
+    @property
+    def state(self) -> TaskState:
+        """
+        state of the task in the default run context
+        """
+        return self._state
+
     # Flush methods should be used if task manager is a global instance
     # to avoid two subsequent operations from accessing the same instance's
     # data in computer's memory
 
-    def _flush_output(self):
-        """
-        flushes outputs
+    def flush(self):
+        """flushes outputs and statuses"""
+        self._state.flush()
+
+    def run(self, **kwargs):
+        """
+                runs task and save the output
+                Args:
+                    get_output_for: Callable - a method to access other tasks' outputs
+                    rollback:       Callable - a function to be registered as a rollback task for this task
+        "
+                Returns:
+                    N/A
+
+                Raises:
+                    Re-raises the original exception"
+        """
+        self._state.run(self._action, **kwargs)
+
+    def record_result(
+        self,
+        kwargs: typing.Dict[str, typing.Any],
+        output: typing.Any = None,
+        exception: typing.Optional[BaseException] = None,
+    ):
+        """
+        saves the result of the action when it was executed outside
+        of run(), e.g. in a worker process
+        """
+        self._state.record_result(kwargs, output=output, exception=exception)
+
+    async def run_async(self, **kwargs):
+        """
+        runs task and save the output like run() but awaits the output
+        when the action (or rollback) is a coroutine function.
+
+        Raises:
+            Re-raises the original exception
+        """
+        await self._state.run_async(self._action, **kwargs)
+
+    def is_async(self):
+        """
+        check if the action of this task is a coroutine function
+        """
+        return inspect.iscoroutinefunction(self._action)
+
+    def get_output(self) -> typing.Any:
+        """
+        returns task's output
+        """
+        return self._state.get_output()
+
+    def has_run(self):
+        """
+        check if this task has been executed
+        """
+        return self._state.has_run()
+
+    def is_success(self):
+        """
+        check if the execution of this task was successful
+        """
+        return self._state.is_success()
+
+    def uses_output(self):
+        """
+        check if this task needs to access outputs from other tasks.
+        defaults to True.
+        """
+        return bool(self._flags & _USES_OUTPUT)
+
+    def rollback_uses_output(self):
+        """
+        check if rollback needs access to outputs from other tasks.
+        Defaults to True.
+        """
+        return bool(self._flags & _ROLLBACK_USES_OUTPUT)
+
+    def depends_on(self) -> typing.Tuple[str, ...]:
+        """
+        Returns names of the tasks that must succeed before this task
+        can be run by the parallel executor.
+        """
+        return self._depends_on
+
+    def executor(self) -> typing.Optional[str]:
+        """
+        Returns where the task is executed by the concurrent executors:
+        "inline", "thread", "process" or None for the default of the executor
+        (a thread in run_tasks_parallel, the event loop in run_tasks_async).
+        run_tasks() runs process tasks in the process pool, one at a time.
+        """
+        return self._executor
+
+    def timeout(self) -> typing.Optional[float]:
+        """
+        Returns the seconds the task may run before it fails with
+        TaskTimeoutError or None for no limit.
+        """
+        return self._timeout
+
+    def uses_cache(self):
+        """
+        check if outputs of this task are served from the task manager's
+        cache when the task is run again with the same input and the same
+        outputs of the tasks it reads. Defaults to False.
+        """
+        return bool(self._flags & _USES_CACHE)
+
+    def retains_output(self):
+        """
+        check if the output of this task is kept after the tasks reading it
+        finished when the task manager releases outputs. Defaults to False.
+        """
+        return bool(self._flags & _RETAIN_OUTPUT)
+
+    def batchable(self):
+        """
+        check if calls of this task by concurrent runs are coalesced into
+        one call with the list of their inputs. Defaults to False.
+        """
+        return bool(self._flags & _BATCHABLE)
+
+    def single_flight(self):
+        """
+        check if a call of this task with the same input as a call in
+        progress in a concurrent run shares its output or exception
+        instead of running again. Defaults to False.
+        """
+        return bool(self._flags & _SINGLE_FLIGHT)
+
+    def get_input(self):
+        """
+        Returns input as dictionary (what was sent as input to the task)
+        """
+        return self._state.get_input()
+
+    def get_exception(self):
+        return self._state.get_exception()
+
+
+class TaskFailedError(Exception):
+    """
+    this exception should be raised when
+    executed task was a failure
+    """
+
+
+class OutputNotAvailableError(Exception):
+    """
+    this exception should be raised when
+    task output is not available because
+    the task has not run.
+    """
+
+
+class TaskTimeoutError(Exception):
+    """
+    this exception is recorded as the exception of a task
+    which did not finish within its timeout or before the
+    deadline of the run.
+    """
+
+
+class _ResolvedOutputs:
+    """
+    Picklable replacement for get_output_for which is shipped to
+    process tasks together with the outputs of their depends_on tasks.
+    Outputs handed over in shared memory are loaded on first access and
+    their segments stay attached until close().
+    """
+
+    def __init__(self, outputs: typing.Dict[str, typing.Any]):
+        self._outputs = outputs
+        self._loaded: typing.Dict[str, typing.Any] = {}
+
+    def __call__(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
+        # outputs are resolved before the task starts, nothing to wait for
+        try:
+            output = self._outputs[task_name]
+        except KeyError as e:
+            raise OutputNotAvailableError(
+                f"{task_name} is not listed in depends_on therefore its output "
+                "is not available in a process task."
+            ) from e
+        if isinstance(output, SharedOutput):
+            if task_name not in self._loaded:
+                self._loaded[task_name] = output.load()
+            return self._loaded[task_name]
+        return output
+
+    def close(self):
+        """
+        Drops the loaded outputs and closes their segments
+        """
+        self._loaded = {}
+        for output in self._outputs.values():
+            if isinstance(output, SharedOutput):
+                output.close()
+
+
+class _Executors:
+    """
+    Lazily created thread and process pools for a single run and the
+    shared memory segments of outputs handed to its process tasks
+    """
+
+    def __init__(self, max_workers=None, max_processes=None, shared_memory=None):
+        self._max_workers = max_workers
+        self._max_processes = max_processes
+        # minimum buffer size handed over in shared memory (None = never)
+        self._shared_memory = shared_memory
+        # task name -> output or its SharedOutput
+        self._shared: typing.Dict[str, typing.Any] = {}
+        self._segments: typing.List[typing.Any] = []
+        self._lock = threading.Lock()
+        self._thread_pool: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._process_pool: typing.Optional[
+            concurrent.futures.ProcessPoolExecutor
+        ] = None
+
+    @property
+    def thread_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = concurrent.futures.ThreadPoolExecutor(self._max_workers)
+        return self._thread_pool
+
+    @property
+    def process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = concurrent.futures.ProcessPoolExecutor(
+                self._max_processes, mp_context=_process_context()
+            )
+        return self._process_pool
+
+    def share(self, task_name: str, output: typing.Any) -> typing.Any:
+        """
+        Returns what is sent to process tasks for an output: a SharedOutput
+        when it has large buffers, created once per run
+        """
+        if self._shared_memory is None:
+            return output
+        with self._lock:
+            if task_name not in self._shared:
+                shared, segments = share(output, self._shared_memory)
+                self._shared[task_name] = shared
+                self._segments.extend(segments)
+            return self._shared[task_name]
+
+    def shutdown(self):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        release_segments(self._segments)
+        self._segments = []
+        self._shared = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+class _Claims:
+    """
+    Tasks of an ongoing run_tasks_parallel() whose outputs may be read
+    before they finished (undeclared dependencies). A task is run by
+    whoever claims it first: the worker started by the scheduler or a
+    task reading its output before it started, which then runs it inline
+    instead of blocking a worker the task might be queued behind.
+    """
+
+    def __init__(
+        self,
+        tasks: typing.Iterable[str],
+        kwargs: typing.Dict[str, typing.Any],
+        executors: "_Executors",
+    ):
+        # completion of every task of the run, whoever runs it
+        self.futures: typing.Dict[str, concurrent.futures.Future] = {
+            t: concurrent.futures.Future() for t in tasks
+        }
+        self.kwargs = kwargs
+        # executors of the run, process tasks claimed by readers are
+        # submitted to them
+        self.executors = executors
+        # tasks started without waiting for their upstream tasks
+        self.eager: typing.Set[str] = set()
+        # tasks submitted by the scheduler
+        self.submitted: typing.Set[str] = set()
+        # tasks run inline by tasks reading their output
+        self.run_by_readers: typing.List[str] = []
+        self._claimed: typing.Set[str] = set()
+        # running task -> task it waits for
+        self._waiting: typing.Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def claim(self, task_name: str) -> bool:
+        with self._lock:
+            if task_name in self._claimed:
+                return False
+            self._claimed.add(task_name)
+            return True
+
+    @contextlib.contextmanager
+    def running(self, task_name: str):
+        """
+        marks the task as the one running in the current thread
+        """
+        stack = getattr(self._local, "running", None)
+        if stack is None:
+            stack = self._local.running = []
+        stack.append(task_name)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    @contextlib.contextmanager
+    def waiting_on(self, task_name: str):
+        """
+        records that the task running in the current thread waits for
+        another task
+
+        Raises:
+            Exception when the wait would never end
+        """
+        stack = getattr(self._local, "running", None)
+        if not stack:
+            yield
+            return
+        current = stack[-1]
+        with self._lock:
+            cycle = [current]
+            t: typing.Optional[str] = task_name
+            while t is not None:
+                cycle.append(t)
+                if t == current:
+                    raise Exception(f"Dependency cycle detected between tasks {cycle}")
+                t = self._waiting.get(t)
+            self._waiting[current] = task_name
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._waiting[current]
+
+
+class RollbackStack:
+    """
+    Unique (by name) rollback tasks in the order they should be run,
+    most recently registered first. Pushing and membership checks
+    are constant time.
+    """
+
+    def __init__(self):
+        self._names: typing.List[str] = []
+        self._registered: typing.Set[str] = set()
+        # rollback task -> tasks it rolls back
+        self._forwards: typing.Dict[str, typing.List[str]] = {}
+
+    def push(self, task_name: str, forward: typing.Optional[str] = None):
+        """
+        adds a rollback task unless it has been added already and
+        remembers which task (forward) it rolls back
+        """
+        if task_name not in self._registered:
+            self._registered.add(task_name)
+            self._names.append(task_name)
+        if forward is not None:
+            forwards = self._forwards.setdefault(task_name, [])
+            if forward not in forwards:
+                forwards.append(forward)
+
+    def forwards(self, task_name: str) -> typing.List[str]:
+        """
+        returns the tasks the rollback task was registered for
+        """
+        return self._forwards.get(task_name, [])
+
+    def __contains__(self, task_name) -> bool:
+        return task_name in self._registered
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return reversed(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __repr__(self) -> str:
+        return f"RollbackStack({list(self)})"
+
+
+class TaskManagerResult:
+    """
+    Result for all tasks registered in the task manager
+    """
+
+    __slots__ = (
+        "tasks_success",
+        "tasks_failed",
+        "exceptions",
+        "timings",
+        "rollback_tasks",
+        "dependencies",
+        "peak_output_bytes",
+    )
+
+    def __init__(
+        self,
+        tasks_success=None,
+        tasks_not_run=None,
+        tasks_failed=None,
+        exceptions=None,
+        timings=None,
+        rollback_tasks=None,
+        dependencies=None,
+        peak_output_bytes=0,
+    ):
+        self.tasks_success = tasks_success or []
+        self.tasks_failed = tasks_failed or []
+        self.exceptions = exceptions or []
+        # task name -> TaskTiming, only when the task manager instruments
+        self.timings: typing.Dict[str, TaskTiming] = timings or {}
+        # rollback tasks registered during the run, most recent first
+        self.rollback_tasks: typing.List[str] = rollback_tasks or []
+        # task name -> upstream task names of the tasks with timings
+        self.dependencies: typing.Dict[str, typing.Tuple[str, ...]] = dependencies or {}
+        # highest sizeof() total of the outputs kept at the same
+        # time, only when the task manager instruments or releases outputs
+        self.peak_output_bytes = peak_output_bytes
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def aggregate(self) -> typing.Dict[str, typing.Any]:
+        """
+        Returns totals over the recorded timings: number of tasks, summed
+        wall and CPU time, the span from the first start to the last finish,
+        the average parallelism (wall / span) and the slowest task.
+        """
+        if not self.timings:
+            return {"tasks": 0, "wall": 0.0, "cpu": 0.0, "span": 0.0}
+        timings = self.timings.values()
+        wall = sum(timing.wall for timing in timings)
+        span = max(timing.finished for timing in timings) - min(
+            timing.started for timing in timings
+        )
+        slowest = max(self.timings, key=lambda t: self.timings[t].wall)
+        return {
+            "tasks": len(self.timings),
+            "wall": wall,
+            "cpu": sum(timing.cpu or 0.0 for timing in timings),
+            "span": span,
+            "parallelism": wall / span if span else 1.0,
+            "slowest": (slowest, self.timings[slowest].wall),
+        }
+
+    def to_chrome_trace(self) -> typing.Dict[str, typing.Any]:
+        """
+        Returns the timings as Chrome trace event JSON which can be opened
+        in Perfetto (ui.perfetto.dev) or chrome://tracing: one span per task
+        and rollback task in the lane of the thread/process which ran it
+        and a flow arrow from every upstream task to its dependants.
+        Requires TaskManager(instrument=True).
+        """
+        if not self.timings:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+        origin = min(timing.started for timing in self.timings.values())
+        failed = set(self.tasks_failed)
+        rollbacks = set(self.rollback_tasks)
+
+        def microseconds(timestamp: float) -> float:
+            return (timestamp - origin) * 1e6
+
+        events: typing.List[typing.Dict[str, typing.Any]] = []
+        process_ids = {timing.process_id for timing in self.timings.values()}
+        for process_id in sorted(process_ids):
+            events.append(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": process_id,
+                    "args": {"name": f"task_manager {process_id}"},
+                }
+            )
+        for t, timing in self.timings.items():
+            args: typing.Dict[str, typing.Any] = {"success": t not in failed}
+            if timing.cpu is not None:
+                args["cpu_ms"] = timing.cpu * 1e3
+            events.append(
+                {
+                    "name": t,
+                    "cat": "rollback" if t in rollbacks else "task",
+                    "ph": "X",
+                    "ts": microseconds(timing.started),
+                    "dur": timing.wall * 1e6,
+                    "pid": timing.process_id,
+                    "tid": timing.thread_id,
+                    "args": args,
+                }
+            )
+        flow_id = 0
+        for t, upstream in self.dependencies.items():
+            for dep in upstream:
+                if dep not in self.timings or t not in self.timings:
+                    continue
+                flow_id += 1
+                source, target = self.timings[dep], self.timings[t]
+                events.append(
+                    {
+                        "name": "depends_on",
+                        "cat": "dependency",
+                        "ph": "s",
+                        "id": flow_id,
+                        # inside the upstream span so the arrow binds to it
+                        "ts": max(
+                            microseconds(source.started),
+                            microseconds(source.finished) - 0.001,
+                        ),
+                        "pid": source.process_id,
+                        "tid": source.thread_id,
+                    }
+                )
+                events.append(
+                    {
+                        "name": "depends_on",
+                        "cat": "dependency",
+                        "ph": "f",
+                        "bp": "e",
+                        "id": flow_id,
+                        "ts": microseconds(target.started),
+                        "pid": target.process_id,
+                        "tid": target.thread_id,
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        """
+        Writes to_chrome_trace() to a JSON file
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+class RunOutcome(typing.NamedTuple):
+    """
+    Result of running a plan for one input of ExecutionPlan.run_many():
+    the position of the input, the keyword arguments, the run context
+    holding the outputs and the exception the run failed with (None when
+    it succeeded). Failed runs have already been rolled back.
+    """
+
+    position: int
+    kwargs: typing.Dict[str, typing.Any]
+    context: "RunContext"
+    exception: typing.Optional[BaseException]
+
+
+class ExecutionPlan:
+    """
+    Validated list of tasks compiled by TaskManager.compile(). Task names
+    are checked and the rollback order is computed once, running the plan
+    runs its tasks exactly like run_tasks() does.
+
+    Usage example:
+
+    plan = tm.compile(["example1", "example2"])
+    for request in requests:
+        context = plan.run(request=request)
+    """
+
+    def __init__(self, manager: "TaskManager", tasks: typing.Iterable[str]):
+        tasks = tuple(tasks)
+        for t in tasks:
+            if t not in manager.tasks:
+                raise Exception(f"Unknown task '{t}'. Check registered tasks")
+        self._manager = manager
+        self._tasks = tasks
+        rollback_order = RollbackStack()
+        for t in tasks:
+            rollback = manager.tasks[t].rollback
+            if rollback is not None:
+                rollback_order.push(rollback.__name__)
+        self._rollback_order = tuple(rollback_order)
+
+    @property
+    def manager(self) -> "TaskManager":
+        return self._manager
+
+    @property
+    def tasks(self) -> typing.Tuple[str, ...]:
+        return self._tasks
+
+    @property
+    def rollback_order(self) -> typing.Tuple[str, ...]:
+        """
+        rollback tasks in the order they are run if the last task fails
+        """
+        return self._rollback_order
+
+    def run(self, **kwargs) -> "RunContext":
+        """
+        Runs the plan in a new run context and returns the context.
+        """
+        return self._manager.new_context().run_plan(self, **kwargs)
+
+    def _run_outcome(
+        self, position: int, kwargs: typing.Dict[str, typing.Any]
+    ) -> RunOutcome:
+        context = self._manager.new_context()
+        try:
+            context.run_plan(self, **kwargs)
+        except Exception as e:  # pylint: disable=broad-except
+            return RunOutcome(position, kwargs, context, e)
+        return RunOutcome(position, kwargs, context, None)
+
+    def run_many(
+        self,
+        inputs: typing.Iterable[typing.Dict[str, typing.Any]],
+        concurrency: int = 1,
+    ) -> typing.Iterator[RunOutcome]:
+        """
+        Runs the plan once for every dict of keyword arguments in inputs,
+        each run in its own run context so a failing input only rolls back
+        its own tasks. Inputs are read lazily and at most concurrency runs
+        are in flight (on a thread pool when concurrency > 1).
+
+        Returns:
+            iterator of RunOutcome in the order the runs complete
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if concurrency == 1:
+            for position, kwargs in enumerate(inputs):
+                yield self._run_outcome(position, kwargs)
+            return
+        pending: typing.Set[concurrent.futures.Future] = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for position, kwargs in enumerate(inputs):
+                if len(pending) >= concurrency:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(self._run_outcome, position, kwargs))
+            for future in concurrent.futures.as_completed(pending):
+                yield future.result()
+
+
+class RunContext:
+    """
+    State of a single run of the tasks registered in a TaskManager:
+    status, input and output of every task and the rollback tasks to be
+    run on failure. The task registry is shared and only read, so runs
+    in separate contexts need no locking. Tasks in outputs (task name ->
+    output) start out succeeded, e.g. when a run is resumed.
+
+    Usage example:
+
+    context = tm.new_context()
+    context.run_tasks(["example1"])
+    print(context.get_output_for("example1"))
+    """
+
+    def __init__(
+        self,
+        manager: "TaskManager",
+        states: typing.Optional[typing.Dict[str, TaskState]] = None,
+        run_id: typing.Optional[str] = None,
+        outputs: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ):
+        self._run_id = run_id
+        # Whether the journal holds the records of the run, a resumed
+        # run's journal does while completed journals are deleted
+        self._journal_open = run_id is not None
+        self._manager = manager
+        self._tasks = manager.tasks
+        self._states: typing.Dict[str, TaskState] = {} if states is None else states
+        # Generation of the states, advanced by flush()
+        self._epoch = _Epoch()
+        for state in self._states.values():
+            state._attach(self._epoch)
+        # Store for rollback actions in case we need to use them
+        self._on_rollback = RollbackStack()
+        # Tasks run by run_tasks() depend on every task run before them,
+        # so their rollback tasks are run one by one
+        self._serial_rollback = False
+        # Completion events of the tasks in the ongoing run_tasks_async
+        self._async_done: typing.Dict[str, asyncio.Event] = {}
+        # Tasks of the ongoing run_tasks_async which have been started and
+        # the task each running coroutine awaits the output of
+        self._async_started: typing.Set[str] = set()
+        self._async_waiting: typing.Dict[str, str] = {}
+        # Tasks of the ongoing run_tasks_parallel when dependencies are inferred
+        self._claims: typing.Optional[_Claims] = None
+        # Configuration of the task manager, see TaskManager.__init__()
+        self._instrument = manager._instrument
+        self._infer_dependencies = manager._infer_dependencies
+        self._eager = manager._eager
+        self._output_timeout = manager._output_timeout
+        self._release_outputs = manager._release_outputs
+        self._run_timeout = manager._run_timeout
+        self._rollback_workers = manager._rollback_workers
+        self._max_workers = manager._max_workers
+        self._max_processes = manager._max_processes
+        self._shared_memory = manager._shared_memory
+        # Tasks whose outputs each cached task read, shared by all contexts
+        self._cache_reads = manager._cache_reads
+        self._track_outputs = (
+            self._instrument or self._release_outputs or manager.spill is not None
+        )
+        # Tasks reading each output which have not succeeded yet
+        self._consumers: typing.Dict[str, int] = {}
+        # Outputs registered rollback tasks may read, they are kept
+        # until the context is flushed
+        self._pinned: typing.Set[str] = set()
+        # Outputs the caller of the ongoing run reads afterwards
+        self._retain: typing.Set[str] = set()
+        # sizeof() of the outputs kept by the context, their total
+        # and the highest total
+        self._output_bytes: typing.Dict[str, int] = {}
+        self._retained_bytes = 0
+        self._peak_output_bytes = 0
+        # Outputs written to the task manager's spill store
+        self._spilled: typing.Dict[str, SpilledOutput] = {}
+        # time.monotonic() by which the ongoing run has to finish
+        self._deadline: typing.Optional[float] = None
+        # CPU time of timed actions run in a thread of their own when
+        # instrumenting, read by _run_task()
+        self._worker_cpu: typing.Dict[str, typing.Optional[float]] = {}
+        if outputs:
+            self._restore(outputs)
+
+    @property
+    def rollback_stack(self) -> RollbackStack:
+        """
+        rollback tasks registered by the runs of this context
+        """
+        return self._on_rollback
+
+    @property
+    def run_id(self) -> str:
+        """
+        identifies the run, e.g. in the task manager's journal
+        """
+        if self._run_id is None:
+            self._run_id = uuid.uuid4().hex
+        return self._run_id
+
+    def _executors(self) -> _Executors:
+        return _Executors(self._max_workers, self._max_processes, self._shared_memory)
+
+    def _state(self, task_name: str) -> TaskState:
+        """
+        Returns the state of a task in this context
+        """
+        state = self._states.get(task_name)
+        if state is None:
+            state = self._states.setdefault(task_name, TaskState(self._epoch))
+        return state
+
+    def _has_succeeded(self, task_name: str) -> bool:
+        state = self._states.get(task_name)
+        return state is not None and state.has_run() and bool(state.is_success())
+
+    def flush(self):
+        """
+        flushes outputs and statuses of all tasks and forgets registered
+        rollback tasks. Takes constant time: states are flushed when they
+        are accessed next.
+        """
+        self._epoch.generation += 1
+        self._on_rollback = RollbackStack()
+        self._serial_rollback = False
+        self._run_id = None
+        self._journal_open = False
+        self._consumers = {}
+        self._pinned = set()
+        self._retain = set()
+        self._output_bytes = {}
+        self._retained_bytes = 0
+        self._peak_output_bytes = 0
+        for spilled in self._spilled.values():
+            spilled.delete()
+        self._spilled = {}
+        self._deadline = None
+
+    def _restore(self, outputs: typing.Dict[str, typing.Any]):
+        """
+        Marks tasks as succeeded with the given outputs and registers
+        their rollback tasks, e.g. when resuming a run from a journal
+        """
+        for t, output in outputs.items():
+            if t not in self._tasks:
+                continue
+            self._state(t).record_result({}, output=output)
+            self._on_task_success(t, journal=False)
+
+    def _start_run(
+        self,
+        mode: str,
+        tasks: typing.Sequence[str],
+        retain: typing.Iterable[str] = (),
+    ):
+        """
+        Journals the start of a run, starts the run's deadline and counts
+        the consumers of outputs when the task manager releases them.
+        Outputs of the tasks in retain are not released during the run.
+        """
+        run_timeout = self._run_timeout
+        if run_timeout is not None:
+            self._deadline = time.monotonic() + run_timeout
+        journal = self._manager.journal
+        if journal is not None:
+            journal.record_start(self.run_id, mode, tasks)
+            if not self._journal_open:
+                self._journal_succeeded(journal)
+        if self._release_outputs:
+            consumers: typing.Dict[str, int] = {}
+            for t in dict.fromkeys(tasks):
+                if t in self._tasks and not self._has_succeeded(t):
+                    for dep in self._dependencies(t):
+                        consumers[dep] = consumers.get(dep, 0) + 1
+            self._consumers = consumers
+            self._retain = set(retain)
+
+    def _journal_succeeded(self, journal: Journal):
+        """
+        Journals the outputs of every task which succeeded in earlier,
+        completed runs of this context, whose journal has been deleted,
+        so the run can be resumed whichever outputs its tasks read
+        """
+        self._journal_open = True
+        for t, state in list(self._states.items()):
+            if self._has_succeeded(t) and not state.is_released():
+                journal.record_success(self.run_id, t, state.get_output())
+
+    def _finish_run(self):
+        """
+        Journals that the run has succeeded or has been rolled back
+        """
+        journal = self._manager.journal
+        if journal is not None:
+            journal.record_complete(self.run_id)
+            self._journal_open = journal.keep_completed
+
+    def _track_output(self, task_name: str):
+        """
+        Accounts for the output of a succeeded task, releases the outputs
+        whose consumers have all succeeded now and spills outputs when
+        the kept outputs exceed the spill store's budget
+        """
+        size = sizeof(self._states[task_name].get_output())
+        self._retained_bytes += size - self._output_bytes.get(task_name, 0)
+        self._output_bytes[task_name] = size
+        self._peak_output_bytes = max(self._peak_output_bytes, self._retained_bytes)
+        if self._release_outputs:
+            task = self._tasks[task_name]
+            if task.rollback and task.rollback_uses_output():
+                # its rollback task may read the outputs the task read
+                self._pinned.update(self._dependencies(task_name))
+        if self._consumers:
+            for dep in self._dependencies(task_name):
+                remaining = self._consumers.get(dep)
+                if remaining is None:
+                    continue
+                self._consumers[dep] = remaining - 1
+                if remaining == 1:
+                    self._release_output(dep)
+        spill = self._manager.spill
+        if spill is not None and self._retained_bytes > spill.max_bytes:
+            self._spill_outputs(spill)
+
+    def _spill_outputs(self, spill: SpillStore):
+        """
+        Spills the largest outputs until the kept outputs fit the budget
+        """
+        sizes = self._output_bytes
+        for t in sorted(sizes, key=sizes.__getitem__, reverse=True):
+            if self._retained_bytes <= spill.max_bytes:
+                return
+            state = self._states[t]
+            if not state.is_success() or state.is_released():
+                continue
+            spilled = spill.spill(state.get_output())
+            if spilled is None:
+                continue
+            state.spill(spilled)
+            self._spilled[t] = spilled
+            self._retained_bytes -= sizes.pop(t)
+
+    def _release_output(self, task_name: str):
+        """
+        Releases an output unless the task retains it, the caller of the
+        run reads it or a registered rollback task may read it
+        """
+        task = self._tasks[task_name]
+        state = self._states.get(task_name)
+        if (
+            state is None
+            or task.retains_output()
+            or (task.rollback and task.rollback_uses_output())
+            or task_name in self._pinned
+            or task_name in self._retain
+        ):
+            return
+        state.release()
+        self._retained_bytes -= self._output_bytes.pop(task_name, 0)
+        spilled = self._spilled.pop(task_name, None)
+        if spilled is not None:
+            spilled.delete()
+
+    def has_run(self, task_name: str) -> bool:
+        """
+        check if the task has been executed in this context
+        """
+        state = self._states.get(task_name)
+        return state is not None and state.has_run()
+
+    def is_success(self, task_name: str):
+        """
+        check if the execution of the task was successful in this context
+        """
+        state = self._states.get(task_name)
+        return None if state is None else state.is_success()
+
+    def _get_output_for(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
+        """
+        Returns output from the selected task. During a run_tasks_parallel()
+        with inferred dependencies or eager launching, waits for the task
+        to finish if it is part of the run.
+
+        Arguments:
+            task_name: str - Name/Identifier of the task
+            timeout: float - seconds to wait at most, defaults to the task
+                manager's output_timeout (None = no limit)
+
+        Returns:
+            typing.Any (Output can be anything)
+
+        Raises:
+            Re-raises the original exception
+            KeyError when task cannot be find in registered tasks
+            OutputNotAvailableError when the task did not run or did not
+            finish in time
+            TaskFailedError when the awaited task failed
+        """
+        try:
+            self._tasks[task_name]
+        except KeyError as e:
+            raise Exception(
+                f"_get_output_for could not find '{task_name}' from registered tasks"
+            ) from e
+        claims = self._claims
+        if claims is not None and task_name in claims.futures:
+            self._await_claimed(task_name, claims, timeout)
+        selected = self._states.get(task_name)
+        if selected is None or not selected.has_run():
+            raise OutputNotAvailableError(
+                f"{task_name} has not run therefore its output is not available."
+            )
+        if selected.is_released():
+            raise OutputNotAvailableError(
+                f"{task_name} output has been released after the tasks reading it "
+                "finished. Register it with retain_output=True to keep it."
+            )
+        return selected.get_output()
+
+    def get_output_for(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
+        """
+        public method for _get_output_for()
+        """
+        return self._get_output_for(task_name, timeout)
+
+    async def _get_output_for_async(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
+        """
+        Returns output from the selected task like _get_output_for() but
+        first waits for the task to finish if it is scheduled in the
+        ongoing run_tasks_async.
+
+        Raises:
+            OutputNotAvailableError when the task did not run or did not
+            finish within timeout seconds (default: output_timeout)
+            Exception when the wait would never end
+        """
+        done = self._async_done.get(task_name)
+        if done is not None and not done.is_set():
+            if timeout is None:
+                timeout = self._output_timeout
+            current = _current_async_task.get()
+            if current is not None and current in self._async_done:
+                cycle = self._async_wait_cycle(current, task_name)
+                if cycle:
+                    raise Exception(f"Dependency cycle detected between tasks {cycle}")
+                self._async_waiting[current] = task_name
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+            except asyncio.TimeoutError as e:
+                raise OutputNotAvailableError(
+                    f"{task_name} did not finish within {timeout} seconds"
+                ) from e
+            finally:
+                if current is not None:
+                    self._async_waiting.pop(current, None)
+        return self._get_output_for(task_name)
+
+    def _async_wait_cycle(self, current: str, task_name: str) -> typing.List[str]:
+        """
+        Returns the tasks through which task_name (transitively) waits for
+        the current task in the ongoing run_tasks_async, ending with the
+        current task, or [] when the current task can wait for it. Running
+        tasks wait for the output they await, tasks which have not been
+        started yet for their unfinished dependencies.
+        """
+        parents: typing.Dict[str, typing.Optional[str]] = {task_name: None}
+        stack = [task_name]
+        while stack:
+            t = stack.pop()
+            if t == current:
+                cycle = [t]
+                parent = parents[t]
+                while parent is not None:
+                    cycle.append(parent)
+                    parent = parents[parent]
+                return [current] + cycle[::-1]
+            if t in self._async_waiting:
+                waits_for = [self._async_waiting[t]]
+            elif t not in self._async_started:
+                waits_for = [
+                    d
+                    for d in self._dependencies(t)
+                    if d in self._async_done and not self._async_done[d].is_set()
+                ]
+            else:
+                waits_for = []
+            for d in waits_for:
+                if d not in parents:
+                    parents[d] = t
+                    stack.append(d)
+        return []
+
+    async def get_output_for_async(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
+        """
+        public method for _get_output_for_async()
+        """
+        return await self._get_output_for_async(task_name, timeout)
+
+    def _register_rollback_task(
+        self, function: typing.Callable, forward: typing.Optional[str] = None
+    ):
+        """
+        Registers a rollback task to be run if this run fails.
+        The rollback task itself is registered by TaskManager.register_task().
+        """
+        # add unique (by name) rollback tasks only
+        self._on_rollback.push(function.__name__, forward)
+
+    def _nearest_rollbacks(
+        self,
+        task_name: str,
+        rollbacks_of: typing.Dict[str, typing.List[str]],
+        memo: typing.Dict[str, typing.Set[str]],
+    ) -> typing.Set[str]:
+        """
+        Returns the closest upstream tasks (through depends_on and inferred
+        dependencies) of a task which have pending rollback tasks
+        """
+        stack = [(task_name, iter(self._dependencies(task_name)))]
+        while stack:
+            t, deps = stack[-1]
+            for dep in deps:
+                if dep not in memo and dep not in rollbacks_of and dep in self._tasks:
+                    stack.append((dep, iter(self._dependencies(dep))))
+                    break
+            else:
+                stack.pop()
+                nearest: typing.Set[str] = set()
+                for dep in self._dependencies(t):
+                    if dep in rollbacks_of:
+                        nearest.add(dep)
+                    elif dep in memo:
+                        nearest |= memo[dep]
+                memo[t] = nearest
+        return memo[task_name]
+
+    def _rollback_graph(
+        self,
+    ) -> typing.Optional[
+        typing.Tuple[typing.Dict[str, int], typing.Dict[str, typing.List[str]]]
+    ]:
+        """
+        Builds the graph of pending rollback tasks: the rollback of a task
+        waits for the rollbacks of the tasks depending on it, i.e. the
+        reverse of the depends_on graph.
+
+        Returns:
+            (pending dependency count, dependents) per rollback task or None
+            when the rollback tasks have to be run one by one
+        """
+        if self._serial_rollback or self._rollback_workers <= 1:
+            return None
+        names = [r for r in self._on_rollback if not self._has_succeeded(r)]
+        rollbacks_of: typing.Dict[str, typing.List[str]] = {}
+        for r in names:
+            for forward in self._on_rollback.forwards(r):
+                rollbacks_of.setdefault(forward, []).append(r)
+        edges: typing.Set[typing.Tuple[str, str]] = set()
+        memo: typing.Dict[str, typing.Set[str]] = {}
+        for downstream, downstream_rollbacks in rollbacks_of.items():
+            for upstream in self._nearest_rollbacks(downstream, rollbacks_of, memo):
+                for before in downstream_rollbacks:
+                    for after in rollbacks_of[upstream]:
+                        if before != after:
+                            edges.add((before, after))
+        waiting_for = {r: 0 for r in names}
+        dependents: typing.Dict[str, typing.List[str]] = {r: [] for r in names}
+        for before, after in edges:
+            waiting_for[after] += 1
+            dependents[before].append(after)
+        # a rollback task shared by several tasks may create a cycle
+        if self._find_cycle(names, waiting_for, dependents):
+            return None
+        return waiting_for, dependents
+
+    def _rollback_dependencies(self, **kwargs):
+        """
+        Rollback dependency tasks. When the tasks were run concurrently
+        and the task manager has rollback_workers > 1, independent
+        rollback tasks are run concurrently in reverse dependency order.
+        """
+        # rollback tasks are not bound by the deadline of the failed run
+        self._deadline = None
+        if self._manager.journal is not None:
+            self._manager.journal.record_rollback(self.run_id)
+        graph = self._rollback_graph()
+        if graph is None:
+            self._run_tasks(self._on_rollback, **kwargs)
+            return
+        waiting_for, dependents = graph
+        with _Executors(self._rollback_workers, self._max_processes) as executors:
+            failure = self._run_graph(
+                waiting_for,
+                dependents,
+                lambda t: self._submit_task(t, executors, **kwargs),
+            )
+        if failure:
+            t, exception = failure
+            raise TaskFailedError(f"Task '{t}' failed") from exception
+
+    def _validate_task_names(self, tasks: typing.Iterable[str]):
+        """
+        Raises when a task name cannot be found in registered tasks
+        """
+        for t in tasks:
+            try:
+                self._tasks[t]
+            except KeyError as e:
+                raise Exception(f"Unknown task '{t}'. Check registered tasks") from e
+
+    def _run_task(self, task_name: str, **kwargs):
+        """
+        Runs a single task and checks that it was tagged successful.
+        Records its timing when the task manager instruments.
+
+        Raises:
+            Re-raises the original exception
+            TaskFailedError when task has been tagged non successful
+        """
+        if not self._instrument:
+            self._execute_task(task_name, **kwargs)
+            return
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            self._execute_task(task_name, **kwargs)
+        finally:
+            timing = _finish_timing(started, cpu_started)
+            if task_name in self._worker_cpu:
+                # the action ran in a thread of its own, None when it
+                # timed out or failed
+                timing = timing._replace(cpu=self._worker_cpu.pop(task_name))
+            self._state(task_name).timing = timing
+
+    def _timeout(self, task_name: str) -> typing.Optional[float]:
+        """
+        Returns the seconds a task may run: its timeout or the time left
+        until the run's deadline, whichever is shorter (None = no limit)
+        """
+        timeout = self._tasks[task_name].timeout()
+        if self._deadline is not None:
+            left = self._deadline - time.monotonic()
+            if timeout is None or left < timeout:
+                return left
+        return timeout
+
+    def _action(self, task_name: str) -> typing.Callable:
+        """
+        Returns the action of a task limited to _timeout() seconds
+        """
+        action = self._tasks[task_name].action
+        timeout = self._timeout(task_name)
+        if timeout is None:
+            return action
+        if not self._instrument or inspect.iscoroutinefunction(action):
+            return _time_limited(action, task_name, timeout)
+        self._worker_cpu[task_name] = None
+        return _time_limited(
+            action,
+            task_name,
+            timeout,
+            functools.partial(self._worker_cpu.__setitem__, task_name),
+        )
+
+    def _execute_task(self, task_name: str, **kwargs):
+        current_task = self._tasks[task_name]
+        state = self._state(task_name)
+        if current_task.uses_cache():
+            self._run_cached(task_name, state, **kwargs)
+            reads = self._cache_reads.get(task_name)
+            if self._infer_dependencies and reads is not None:
+                self._manager.inferred_dependencies[task_name] = reads
+        elif not current_task.uses_output():
+            state.run(self._action(task_name), **kwargs)
+        elif self._infer_dependencies:
+            self._run_traced(task_name, state, **kwargs)
+        else:
+            state.run(
+                self._action(task_name), get_output_for=self._get_output_for, **kwargs
+            )
+        if not state.is_success():
+            raise TaskFailedError(f"Task '{task_name}' has been tagged non successful")
+
+    def _run_traced(self, task_name: str, state: TaskState, **kwargs):
+        """
+        Runs a task recording which outputs it reads as its inferred
+        dependencies
+
+        Raises:
+            Re-raises the original exception
+        """
+        reads: typing.List[str] = []
+
+        def get_output_for(
+            name: str, timeout: typing.Optional[float] = None
+        ) -> typing.Any:
+            reads.append(name)
+            return self._get_output_for(name, timeout)
+
+        state.run(self._action(task_name), get_output_for=get_output_for, **kwargs)
+        self._manager.inferred_dependencies[task_name] = tuple(dict.fromkeys(reads))
+
+    def _dependencies(self, task_name: str) -> typing.Tuple[str, ...]:
+        """
+        Returns the depends_on tasks of a task followed by the registered
+        tasks it read on its last run when dependencies are inferred
+        """
+        depends_on = self._tasks[task_name].depends_on()
+        inferred = self._manager.inferred_dependencies.get(task_name)
+        if not inferred:
+            return depends_on
+        return tuple(
+            dict.fromkeys(depends_on + tuple(t for t in inferred if t in self._tasks))
+        )
+
+    def _cache_key(
+        self, task_name: str, kwargs: typing.Dict[str, typing.Any], reads
+    ) -> typing.Optional[str]:
+        """
+        Returns a hash of the action, its input and the outputs of the tasks
+        it reads or None when some of them cannot be hashed.
+        """
+        action = self._tasks[task_name].action
+        outputs = []
+        for t in reads:
+            state = self._states.get(t)
+            if state is None or not state.has_run():
+                return None
+            output_hash = fingerprint(state.get_output())
+            if output_hash is None:
+                return None
+            outputs.append((t, output_hash))
+        inputs = sorted((k, v) for k, v in kwargs.items() if k != "get_output_for")
+        return fingerprint(
+            (
+                task_name,
+                getattr(action, "__module__", None),
+                getattr(action, "__qualname__", None),
+                inputs,
+                outputs,
+            )
+        )
+
+    def _cache_lookup(
+        self, task_name: str, kwargs: typing.Dict[str, typing.Any]
+    ) -> typing.Tuple[typing.Optional[str], typing.Tuple[str, ...], typing.Any]:
+        """
+        Looks up a cached output using the outputs the task read last time
+        (or its depends_on before the first run).
+
+        Returns:
+            (cache key, tasks read, output or MISSING)
+        """
+        reads = self._cache_reads.get(task_name, self._tasks[task_name].depends_on())
+        key = self._cache_key(task_name, kwargs, reads)
+        if key is None:
+            return None, reads, MISSING
+        return key, reads, self._manager.cache.get(key)
+
+    def _cache_store(
+        self,
+        task_name: str,
+        kwargs: typing.Dict[str, typing.Any],
+        key: typing.Optional[str],
+        expected_reads: typing.Tuple[str, ...],
+        reads: typing.Iterable[str],
+        output: typing.Any,
+    ):
+        """
+        Caches the output under the outputs the task actually read
+        """
+        reads = tuple(dict.fromkeys(reads))
+        self._cache_reads[task_name] = reads
+        if reads != expected_reads:
+            key = self._cache_key(task_name, kwargs, reads)
+        if key is not None:
+            self._manager.cache.set(key, output)
+
+    def _run_cached(self, task_name: str, state: TaskState, **kwargs):
+        """
+        Serves the output of a task from the cache or runs the task
+        recording which outputs it reads and caches its output.
+
+        Raises:
+            Re-raises the original exception
+        """
+        current_task = self._tasks[task_name]
+        key, expected_reads, output = self._cache_lookup(task_name, kwargs)
+        if output is not MISSING:
+            state.record_result(kwargs, output=output)
+            return
+        reads: typing.List[str] = []
+        if current_task.uses_output():
+
+            def get_output_for(
+                name: str, timeout: typing.Optional[float] = None
+            ) -> typing.Any:
+                reads.append(name)
+                return self._get_output_for(name, timeout)
+
+            state.run(self._action(task_name), get_output_for=get_output_for, **kwargs)
+        else:
+            state.run(self._action(task_name), **kwargs)
+        self._cache_store(
+            task_name, kwargs, key, expected_reads, reads, state.get_output()
+        )
+
+    async def _run_cached_async(self, task_name: str, state: TaskState, **kwargs):
+        """
+        Like _run_cached() for tasks run on the event loop
+        """
+        current_task = self._tasks[task_name]
+        key, expected_reads, output = self._cache_lookup(task_name, kwargs)
+        if output is not MISSING:
+            state.record_result(kwargs, output=output)
+            return
+        reads: typing.List[str] = []
+        if not current_task.uses_output():
+            await state.run_async(self._action(task_name), **kwargs)
+        elif current_task.is_async():
+
+            async def get_output_for_async(
+                name: str, timeout: typing.Optional[float] = None
+            ) -> typing.Any:
+                reads.append(name)
+                return await self._get_output_for_async(name, timeout)
+
+            await state.run_async(
+                self._action(task_name), get_output_for=get_output_for_async, **kwargs
+            )
+        else:
+
+            def get_output_for(
+                name: str, timeout: typing.Optional[float] = None
+            ) -> typing.Any:
+                reads.append(name)
+                return self._get_output_for(name, timeout)
+
+            await state.run_async(
+                self._action(task_name), get_output_for=get_output_for, **kwargs
+            )
+        self._cache_store(
+            task_name, kwargs, key, expected_reads, reads, state.get_output()
+        )
+
+    def _process_kwargs(
+        self, task_name: str, executors: _Executors, **kwargs
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Returns keyword arguments for a process task with get_output_for
+        resolved to the outputs of its depends_on tasks
+        """
+        current_task = self._tasks[task_name]
+        if not current_task.uses_output():
+            return kwargs
+        outputs = {
+            dep: executors.share(dep, self._get_output_for(dep))
+            for dep in current_task.depends_on()
+        }
+        return {"get_output_for": _ResolvedOutputs(outputs), **kwargs}
+
+    def _submit_task(
+        self, task_name: str, executors: _Executors, **kwargs
+    ) -> concurrent.futures.Future:
+        """
+        Starts a task on the executor selected for it and returns a future
+        which is done once the result has been saved to the task.
+        """
+        current_task = self._tasks[task_name]
+        state = self._state(task_name)
+        executor = current_task.executor() or EXECUTOR_THREAD
+        if executor == EXECUTOR_THREAD:
+            return executors.thread_pool.submit(self._run_task, task_name, **kwargs)
+        result: concurrent.futures.Future = concurrent.futures.Future()
+        if executor == EXECUTOR_INLINE:
+            try:
+                self._run_task(task_name, **kwargs)
+                result.set_result(None)
+            except Exception as e:  # pylint: disable=broad-except
+                result.set_exception(e)
+            return result
+        key = None
+        if current_task.uses_cache():
+            key, _, output = self._cache_lookup(task_name, kwargs)
+            if output is not MISSING:
+                state.record_result(kwargs, output=output)
+                result.set_result(None)
+                return result
+        process_kwargs = self._process_kwargs(task_name, executors, **kwargs)
+        submitted = time.perf_counter()
+
+        def record(future: concurrent.futures.Future):
+            exception = future.exception()
+            if exception is None:
+                output, timing = future.result()
+                state.record_result(process_kwargs, output=output)
+                if self._instrument:
+                    state.timing = timing
+                if current_task.uses_cache():
+                    self._store_process_output(task_name, kwargs, key, output)
+                result.set_result(None)
+            else:
+                state.record_result(process_kwargs, exception=exception)
+                if self._instrument:
+                    state.timing = TaskTiming(
+                        submitted, time.perf_counter(), None, 0, 0
+                    )
+                result.set_exception(exception)
+
+        timeout = self._timeout(task_name)
+        if timeout is None:
+            future = executors.process_pool.submit(
+                _call_timed, current_task.action, process_kwargs
+            )
+        else:
+            # pool workers cannot be terminated, a task which may have to be
+            # is run in a process of its own
+            future = executors.thread_pool.submit(
+                _call_in_process,
+                current_task.action,
+                process_kwargs,
+                task_name,
+                timeout,
+            )
+        future.add_done_callback(record)
+        return result
+
+    def _store_process_output(
+        self,
+        task_name: str,
+        kwargs: typing.Dict[str, typing.Any],
+        key: typing.Optional[str],
+        output: typing.Any,
+    ):
+        """
+        Caches the output of a process task which can only read
+        the outputs of its depends_on tasks
+        """
+        depends_on = self._tasks[task_name].depends_on()
+        self._cache_store(task_name, kwargs, key, depends_on, depends_on, output)
+
+    def _on_task_success(self, task_name: str, journal=True):
+        """
+        Register rollback task only if current task was run succesfully
+        we dont need to rollback the current task because it failed.
+        Records the output in the journal if the task manager has one.
+        """
+        current_task = self._tasks[task_name]
+        if current_task.rollback:
+            self._register_rollback_task(
+                function=current_task.rollback, forward=task_name
+            )
+        if journal and self._manager.journal is not None:
+            self._manager.journal.record_success(
+                self.run_id, task_name, self._states[task_name].get_output()
+            )
+        if self._track_outputs:
+            self._track_output(task_name)
+
+    async def _rollback_dependencies_async(self, **kwargs):
+        """
+        Rollback dependency tasks, awaiting coroutine rollbacks
+        """
+        # rollback tasks are not bound by the deadline of the failed run
+        self._deadline = None
+        if self._manager.journal is not None:
+            self._manager.journal.record_rollback(self.run_id)
+        graph = self._rollback_graph()
+        with self._executors() as executors:
+            if graph is None:
+                for t in self._on_rollback:
+                    try:
+                        if self._has_succeeded(t):
+                            continue
+                        await self._run_task_async(t, executors, **kwargs)
+                    except Exception as e:
+                        raise TaskFailedError(f"Task '{t}' failed") from e
+                return
+            waiting_for, dependents = graph
+            limit = asyncio.Semaphore(self._rollback_workers)
+
+            async def run_limited(task_name):
+                async with limit:
+                    await self._run_task_async(task_name, executors, **kwargs)
+
+            failure = await self._run_graph_async(
+                waiting_for,
+                dependents,
+                lambda t: asyncio.ensure_future(run_limited(t)),
+            )
+        if failure:
+            t, exception = failure
+            raise TaskFailedError(f"Task '{t}' failed") from exception
+
+    def _run_tasks(self, tasks: typing.List[str], **kwargs):
+        """
+        Runs tasks and registers their rollback tasks.
+
+        Arguments:
+            tasks: Callable[str] - list of task names
+
+        Returns:
+            N/A
+
+        Raises:
+            Re-raises the original exception
+            KeyError when task cannot be find in registered tasks
+        """
+        # current_task = None
+        # Validate task names first
+        self._validate_task_names(tasks)
+        self._run_validated(tasks, **kwargs)
+
+    def _run_validated(self, tasks: typing.Iterable[str], **kwargs):
+        """
+        Runs validated tasks one by one and registers their rollback tasks
+
+        Raises:
+            TaskFailedError when a task fails
+        """
+        # created for the first process task
+        executors: typing.Optional[_Executors] = None
+        try:
+            for t in tasks:
+                try:
+                    if self._has_succeeded(t):
+                        continue
+                    if self._tasks[t].executor() == EXECUTOR_PROCESS:
+                        if executors is None:
+                            executors = self._executors()
+                        self._submit_task(t, executors, **kwargs).result()
+                    else:
+                        self._run_task(t, **kwargs)
+                    self._on_task_success(t)
+                except Exception as e:
+                    raise TaskFailedError(f"Task '{t}' failed") from e
+        finally:
+            if executors is not None:
+                executors.shutdown()
+
+    def run_tasks(self, tasks: typing.List[str], **kwargs):
+        """
+        Public method for running tasks. Read docs from _run_tasks
+        for more information.
+        """
+        self._start_run(MODE_SEQUENTIAL, tasks)
+        self._serial_rollback = True
+        try:
+            self._run_tasks(tasks, **kwargs)
+        except Exception:
+            self._rollback_dependencies(**kwargs)
+            self._finish_run()
+            raise
+        self._finish_run()
+        return self
+
+    def _run_plan(self, plan: ExecutionPlan, **kwargs):
+        """
+        Runs the tasks of a compiled plan like _run_tasks() without
+        validating the tasks again.
+
+        Raises:
+            Re-raises the original exception
+        """
+        if plan.manager is not self._manager:
+            raise ValueError("Plan was compiled by another TaskManager")
+        self._run_validated(plan.tasks, **kwargs)
+
+    def run_plan(self, plan: ExecutionPlan, **kwargs) -> "RunContext":
+        """
+        Public method for running a compiled plan. Read docs from _run_plan
+        for more information.
+        """
+        self._start_run(MODE_SEQUENTIAL, plan.tasks)
+        self._serial_rollback = True
+        try:
+            self._run_plan(plan, **kwargs)
+        except Exception:
+            self._rollback_dependencies(**kwargs)
+            self._finish_run()
+            raise
+        self._finish_run()
+        return self
+
+    async def _run_tasks_async(self, tasks: typing.List[str], **kwargs):
+        """
+        Runs tasks concurrently on the running event loop as soon as all
+        tasks listed in their depends_on have succeeded. Follows the same
+        rules as _run_tasks_parallel().
+
+        Arguments:
+            tasks: Callable[str] - list of task names
+
+        Returns:
+            N/A
+
+        Raises:
+            Re-raises the original exception
+            KeyError when task cannot be find in registered tasks
+        """
+        self._validate_task_names(tasks)
+        waiting_for, dependents = self._build_dependency_graph(tasks)
+        if self._eager:
+            # coroutines wait for the outputs they read on the event loop
+            self._launch_eagerly(
+                waiting_for,
+                dependents,
+                {
+                    t
+                    for t in waiting_for
+                    if self._tasks[t].is_async() and self._tasks[t].uses_output()
+                },
+            )
+        self._async_done = {t: asyncio.Event() for t in waiting_for}
+        self._async_started = set()
+        self._async_waiting = {}
+        executors = self._executors()
+        try:
+            failure = await self._run_graph_async(
+                waiting_for,
+                dependents,
+                lambda t: asyncio.ensure_future(
+                    self._run_task_async(t, executors, **kwargs)
+                ),
+            )
+        finally:
+            self._async_done = {}
+            self._async_started = set()
+            self._async_waiting = {}
+            executors.shutdown()
+        if failure:
+            t, exception = failure
+            raise TaskFailedError(f"Task '{t}' failed") from exception
+
+    async def _run_graph_async(
+        self,
+        waiting_for: typing.Dict[str, int],
+        dependents: typing.Dict[str, typing.List[str]],
+        start: typing.Callable[[str], "asyncio.Future"],
+    ) -> typing.Optional[typing.Tuple[str, BaseException]]:
+        """
+        Like _run_graph() for tasks started as asyncio futures
+        """
+        failure: typing.Optional[typing.Tuple[str, BaseException]] = None
+        running = {start(t): t for t in waiting_for if not waiting_for[t]}
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    t = running.pop(future)
+                    exception = future.exception()
+                    if exception is not None:
+                        if not failure:
+                            failure = (t, exception)
+                            # wake up tasks waiting for outputs which never come
+                            for event in self._async_done.values():
+                                event.set()
+                        continue
+                    self._on_task_success(t)
+                    if failure:
+                        continue
+                    for d in dependents[t]:
+                        waiting_for[d] -= 1
+                        if not waiting_for[d]:
+                            running[start(d)] = d
+        finally:
+            for future in running:
+                future.cancel()
+        return failure
+
+    async def run_tasks_async(self, tasks: typing.List[str], **kwargs):
+        """
+        Public coroutine for running tasks on the event loop.
+        Read docs from _run_tasks_async for more information.
+
+        Usage example:
+
+        @tm.task(uses_output=False)
+        async def fetch():
+            ...
+
+        @tm.task(depends_on=["fetch"])
+        async def store(get_output_for):
+            data = await get_output_for("fetch")
+
+        await tm.run_tasks_async(["fetch", "store"])
+        """
+        self._start_run(MODE_ASYNC, tasks)
+        try:
+            await self._run_tasks_async(tasks, **kwargs)
+        except Exception:
+            await self._rollback_dependencies_async(**kwargs)
+            self._finish_run()
+            raise
+        self._finish_run()
+        return self
+
+    def _build_dependency_graph(
+        self, tasks: typing.List[str], inferred=True
+    ) -> typing.Tuple[typing.Dict[str, int], typing.Dict[str, typing.List[str]]]:
+        """
+        Builds the dependency graph of tasks which still have to run.
+        Inferred dependencies on tasks which are scheduled are added unless
+        they contradict the declared ones (create a cycle).
+
+        Returns:
+            (pending dependency count per task, dependents per task)
+
+        Raises:
+            Exception when a dependency is unknown, not scheduled
+            or the dependencies contain a cycle
         """
-        self._output = None
+        pending = [t for t in dict.fromkeys(tasks) if not self._has_succeeded(t)]
+        scheduled = set(pending)
+        waiting_for: typing.Dict[str, int] = {}
+        dependents: typing.Dict[str, typing.List[str]] = {t: [] for t in pending}
+        has_inferred = False
+        for t in pending:
+            waiting_for[t] = 0
+            depends_on = self._tasks[t].depends_on()
+            for dep in depends_on:
+                self._validate_task_names([dep])
+                if dep in scheduled:
+                    waiting_for[t] += 1
+                    dependents[dep].append(t)
+                elif not self._has_succeeded(dep):
+                    raise Exception(
+                        f"Task '{t}' depends on '{dep}' which is not scheduled to run"
+                    )
+            if not inferred:
+                continue
+            for dep in self._dependencies(t)[len(depends_on) :]:
+                if dep in scheduled and dep != t:
+                    has_inferred = True
+                    waiting_for[t] += 1
+                    dependents[dep].append(t)
+        cyclic = self._find_cycle(pending, waiting_for, dependents)
+        if cyclic and has_inferred:
+            return self._build_dependency_graph(tasks, inferred=False)
+        if cyclic:
+            raise Exception(f"Dependency cycle detected between tasks {cyclic}")
+        return waiting_for, dependents
 
-    def _flush_status(self):
-        """
-        flushes statuses
+    @staticmethod
+    def _find_cycle(
+        nodes: typing.List[str],
+        waiting_for: typing.Dict[str, int],
+        dependents: typing.Dict[str, typing.List[str]],
+    ) -> typing.List[str]:
         """
-        self._success = None
-        self._has_run = False
+        Kahn's algorithm, only to detect cycles before anything runs.
 
-    def flush(self):
-        """flushes outputs and statuses"""
-        self._flush_output()
-        self._flush_status()
+        Returns:
+            nodes which are part of or wait for a cycle
+        """
+        remaining = dict(waiting_for)
+        ready = [t for t in nodes if not remaining[t]]
+        visited = 0
+        while ready:
+            t = ready.pop()
+            visited += 1
+            for d in dependents[t]:
+                remaining[d] -= 1
+                if not remaining[d]:
+                    ready.append(d)
+        if visited == len(nodes):
+            return []
+        return [t for t in nodes if remaining[t]]
 
-    def run(self, **kwargs):
+    async def _run_in_process_async(
+        self, task_name: str, executors: _Executors, **kwargs
+    ):
         """
-                runs task and save the output
-                Args:
-                    get_output_for: Callable - a method to access other tasks' outputs
-                    rollback:       Callable - a function to be registered as a rollback task for this task
-        "
-                Returns:
-                    N/A
+        Runs a process task from the event loop
 
-                Raises:
-                    Re-raises the original exception"
+        Raises:
+            Re-raises the original exception
         """
+        current_task = self._tasks[task_name]
+        state = self._state(task_name)
+        key = None
+        if current_task.uses_cache():
+            key, _, output = self._cache_lookup(task_name, kwargs)
+            if output is not MISSING:
+                state.record_result(kwargs, output=output)
+                return
+        process_kwargs = self._process_kwargs(task_name, executors, **kwargs)
+        submitted = time.perf_counter()
+        timeout = self._timeout(task_name)
+        executor: concurrent.futures.Executor
+        if timeout is None:
+            executor, call = executors.process_pool, functools.partial(
+                _call_timed, current_task.action, process_kwargs
+            )
+        else:
+            executor, call = executors.thread_pool, functools.partial(
+                _call_in_process,
+                current_task.action,
+                process_kwargs,
+                task_name,
+                timeout,
+            )
         try:
-            # save keyword arguments (input)
-            self._input = kwargs
-            # run task function/action and save output
-            self._output = self._action(**kwargs)
-            self._success = True
-            self._has_run = True
+            output, timing = await asyncio.get_running_loop().run_in_executor(
+                executor, call
+            )
         except Exception as e:
-            self._exception = e
-            self._success = False
-            self._has_run = True
+            state.record_result(process_kwargs, exception=e)
+            if self._instrument:
+                state.timing = TaskTiming(submitted, time.perf_counter(), None, 0, 0)
             raise
+        state.record_result(process_kwargs, output=output)
+        if self._instrument:
+            state.timing = timing
+        if current_task.uses_cache():
+            self._store_process_output(task_name, kwargs, key, output)
 
-    def get_output(self) -> typing.Any:
+    async def _run_on_loop(self, task_name: str, state: TaskState, **kwargs):
         """
-        returns task's output
+        Runs a task on the event loop
         """
-        return self._output
+        current_task = self._tasks[task_name]
+        if current_task.uses_cache():
+            await self._run_cached_async(task_name, state, **kwargs)
+        elif not current_task.uses_output():
+            await state.run_async(self._action(task_name), **kwargs)
+        elif current_task.is_async():
+            await state.run_async(
+                self._action(task_name),
+                get_output_for=self._get_output_for_async,
+                **kwargs,
+            )
+        else:
+            await state.run_async(
+                self._action(task_name), get_output_for=self._get_output_for, **kwargs
+            )
 
-    def has_run(self):
+    async def _run_task_async(self, task_name: str, executors: _Executors, **kwargs):
         """
-        check if this task has been executed
+        Runs a single task on the event loop. Coroutine actions receive
+        an awaitable get_output_for, synchronous actions the regular one.
+        Synchronous actions are offloaded when their executor is "thread"
+        or "process".
+
+        Raises:
+            Re-raises the original exception
+            TaskFailedError when task has been tagged non successful
         """
-        return self._has_run
+        current_task = self._tasks[task_name]
+        state = self._state(task_name)
+        executor = None if current_task.is_async() else current_task.executor()
+        if current_task.batchable() or (
+            executor != EXECUTOR_PROCESS
+            and not current_task.is_async()
+            and self._timeout(task_name) is not None
+        ):
+            # the first call of a batch blocks until the batch is full and
+            # a timed out synchronous action until its timeout expired
+            executor = EXECUTOR_THREAD
+        self._async_started.add(task_name)
+        token = _current_async_task.set(task_name)
+        try:
+            if executor == EXECUTOR_PROCESS:
+                await self._run_in_process_async(task_name, executors, **kwargs)
+            elif executor == EXECUTOR_THREAD:
+                await asyncio.get_running_loop().run_in_executor(
+                    executors.thread_pool,
+                    functools.partial(self._run_task, task_name, **kwargs),
+                )
+            elif not self._instrument:
+                await self._run_on_loop(task_name, state, **kwargs)
+            else:
+                started = time.perf_counter()
+                try:
+                    await self._run_on_loop(task_name, state, **kwargs)
+                finally:
+                    state.timing = TaskTiming(
+                        started,
+                        time.perf_counter(),
+                        None,
+                        threading.get_ident(),
+                        os.getpid(),
+                    )
+            if not state.is_success():
+                raise TaskFailedError(
+                    f"Task '{task_name}' has been tagged non successful"
+                )
+        finally:
+            _current_async_task.reset(token)
+            done = self._async_done.get(task_name)
+            if done is not None:
+                done.set()
 
-    def is_success(self):
+    def _run_tasks_parallel(self, tasks: typing.List[str], **kwargs):
         """
-        check if the execution of this task was successful
+        Runs tasks on a thread pool as soon as all tasks listed in their
+        depends_on have succeeded. Rollback tasks are registered in the
+        order the tasks complete. After a failure no new tasks are started,
+        tasks already running are waited for and the first failure is raised.
+
+        Arguments:
+            tasks: Callable[str] - list of task names
+
+        Returns:
+            N/A
+
+        Raises:
+            Re-raises the original exception
+            KeyError when task cannot be find in registered tasks
         """
-        return self._success
+        self._validate_task_names(tasks)
+        waiting_for, dependents = self._build_dependency_graph(tasks)
+        with self._executors() as executors:
+            if self._infer_dependencies or self._eager:
+                failure = self._run_graph_claimed(
+                    waiting_for, dependents, executors, **kwargs
+                )
+            else:
+                failure = self._run_graph(
+                    waiting_for,
+                    dependents,
+                    lambda t: self._submit_task(t, executors, **kwargs),
+                )
+        if failure:
+            t, exception = failure
+            raise TaskFailedError(f"Task '{t}' failed") from exception
 
-    def uses_output(self):
+    def _run_graph(
+        self,
+        waiting_for: typing.Dict[str, int],
+        dependents: typing.Dict[str, typing.List[str]],
+        submit: typing.Callable[[str], concurrent.futures.Future],
+    ) -> typing.Optional[typing.Tuple[str, BaseException]]:
         """
-        check if this task needs to access outputs from other tasks.
-        defaults to True.
+        Submits tasks as soon as they are not waiting for other tasks
+        anymore. After a failure no new tasks are submitted and tasks
+        already running are waited for.
+
+        Arguments:
+            waiting_for: number of unfinished dependencies per task
+            dependents: tasks waiting for each task
+            submit: starts a task and returns its future
+
+        Returns:
+            (task name, exception) of the first failure or None
         """
-        return self._uses_output
+        failure: typing.Optional[typing.Tuple[str, BaseException]] = None
+        running = {submit(t): t for t in waiting_for if not waiting_for[t]}
+        while running:
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                t = running.pop(future)
+                exception = future.exception()
+                if exception is not None:
+                    failure = failure or (t, exception)
+                    continue
+                self._on_task_success(t)
+                if failure:
+                    continue
+                for d in dependents[t]:
+                    waiting_for[d] -= 1
+                    if not waiting_for[d]:
+                        running[submit(d)] = d
+        return failure
 
-    def rollback_uses_output(self):
+    def _run_graph_claimed(
+        self,
+        waiting_for: typing.Dict[str, int],
+        dependents: typing.Dict[str, typing.List[str]],
+        executors: _Executors,
+        **kwargs,
+    ) -> typing.Optional[typing.Tuple[str, BaseException]]:
         """
-        check if rollback needs access to outputs from other tasks.
-        Defaults to True.
+        Like _run_graph() but a task reading the output of a scheduled task
+        which has not finished waits for it (see _Claims), so dependencies
+        which are neither declared nor inferred yet still work. When the
+        task manager launches eagerly, thread tasks which use outputs are
+        started right away and only wait for the outputs they read.
+
+        Returns:
+            (task name, exception) of the first failure or None
         """
-        return self._rollback_uses_output
+        claims = _Claims(waiting_for, kwargs, executors)
+        if self._eager:
+            claims.eager = {
+                t
+                for t in waiting_for
+                if self._tasks[t].uses_output()
+                and not self._tasks[t].is_async()
+                and self._tasks[t].executor() in (None, EXECUTOR_THREAD)
+            }
+            self._launch_eagerly(waiting_for, dependents, claims.eager)
+        self._claims = claims
+        try:
+            failure = self._run_graph(
+                waiting_for,
+                dependents,
+                lambda t: self._submit_claimed(t, executors, claims),
+            )
+        finally:
+            self._claims = None
+        # run by readers after the scheduler stopped submitting tasks
+        for t in claims.run_by_readers:
+            future = claims.futures[t]
+            if t not in claims.submitted and future.done() and not future.exception():
+                self._on_task_success(t)
+        return failure
 
-    def get_input(self):
+    @staticmethod
+    def _launch_eagerly(
+        waiting_for: typing.Dict[str, int],
+        dependents: typing.Dict[str, typing.List[str]],
+        eager: typing.Set[str],
+    ):
         """
-        Returns input as dictionary (what was sent as input to the task)
+        Removes the edges to eager tasks from the dependency graph so they
+        are started right away
         """
-        return self._input
+        for t in eager:
+            waiting_for[t] = 0
+        for t, waiting in dependents.items():
+            dependents[t] = [d for d in waiting if d not in eager]
 
-    def get_exception(self):
-        return self._exception
+    def _submit_claimed(
+        self, task_name: str, executors: _Executors, claims: _Claims
+    ) -> concurrent.futures.Future:
+        """
+        Starts a task unless a task reading its output already did and
+        returns the future of its completion
+        """
+        claims.submitted.add(task_name)
+        executor = self._tasks[task_name].executor() or EXECUTOR_THREAD
+        if executor == EXECUTOR_THREAD:
+            executors.thread_pool.submit(self._run_claimed, task_name, claims)
+        elif executor == EXECUTOR_INLINE:
+            self._run_claimed(task_name, claims)
+        elif claims.claim(task_name):
+            # process tasks only read the outputs of their depends_on tasks
+            future = self._submit_task(task_name, executors, **claims.kwargs)
+            future.add_done_callback(
+                functools.partial(self._resolve_claimed, task_name, claims)
+            )
+        return claims.futures[task_name]
 
+    @staticmethod
+    def _resolve_claimed(
+        task_name: str, claims: _Claims, future: concurrent.futures.Future
+    ):
+        exception = future.exception()
+        if exception is not None:
+            claims.futures[task_name].set_exception(exception)
+        else:
+            claims.futures[task_name].set_result(None)
 
-class TaskFailedError(Exception):
-    """
-    this exception should be raised when
-    executed task was a failure
-    """
+    def _run_claimed(self, task_name: str, claims: _Claims) -> bool:
+        """
+        Runs the task in the current thread unless it has been claimed
+        already, after waiting for the tasks it depends on unless it is
+        launched eagerly. Process tasks are submitted to the process pool
+        instead, their future is done once they finished.
 
+        Returns:
+            False when the task was claimed already
+        """
+        if not claims.claim(task_name):
+            return False
+        future = claims.futures[task_name]
+        try:
+            with claims.running(task_name):
+                if task_name not in claims.eager:
+                    for dep in self._dependencies(task_name):
+                        if dep in claims.futures:
+                            self._await_claimed(dep, claims)
+                if self._tasks[task_name].executor() == EXECUTOR_PROCESS:
+                    self._submit_task(
+                        task_name, claims.executors, **claims.kwargs
+                    ).add_done_callback(
+                        functools.partial(self._resolve_claimed, task_name, claims)
+                    )
+                    return True
+                self._run_task(task_name, **claims.kwargs)
+        except Exception as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        return True
 
-class OutputNotAvailableError(Exception):
-    """
-    this exception should be raised when
-    task output is not available because
-    the task has not run.
-    """
+    def _await_claimed(
+        self,
+        task_name: str,
+        claims: _Claims,
+        timeout: typing.Optional[float] = None,
+    ):
+        """
+        Waits for a task of the ongoing run, running it inline (or
+        submitting it when it is a process task) when it has not been
+        started yet.
 
+        Raises:
+            TaskFailedError when the task failed
+            OutputNotAvailableError when the task, run by another thread,
+            did not finish within timeout seconds (default: output_timeout)
+            Exception when the task (transitively) waits for the caller
+        """
+        future = claims.futures[task_name]
+        if not future.done():
+            if timeout is None:
+                timeout = self._output_timeout
+            with claims.waiting_on(task_name):
+                if self._run_claimed(task_name, claims):
+                    claims.run_by_readers.append(task_name)
+                if not concurrent.futures.wait([future], timeout).done:
+                    raise OutputNotAvailableError(
+                        f"{task_name} did not finish within {timeout} seconds"
+                    )
+        exception = future.exception()
+        if exception is not None:
+            raise TaskFailedError(f"Task '{task_name}' failed") from exception
 
-class TaskManagerResult:
-    """
-    Result for all tasks registered in the task manager
-    """
+    def run_tasks_parallel(self, tasks: typing.List[str], **kwargs):
+        """
+        Public method for running independent tasks concurrently.
+        Read docs from _run_tasks_parallel for more information.
+        """
+        self._start_run(MODE_PARALLEL, tasks)
+        try:
+            self._run_tasks_parallel(tasks, **kwargs)
+        except Exception:
+            self._rollback_dependencies(**kwargs)
+            self._finish_run()
+            raise
+        self._finish_run()
+        return self
 
-    def __init__(
-        self, tasks_success=None, tasks_not_run=None, tasks_failed=None, exceptions=None
-    ):
-        self.tasks_success = tasks_success or []
-        self.tasks_failed = tasks_failed or []
-        self.exceptions = exceptions or []
+    def _required_tasks(self, tasks: typing.Iterable[str]) -> typing.List[str]:
+        """
+        Walks depends_on (and inferred dependencies) backwards from the
+        given tasks and returns them
+        together with the upstream tasks they need which have not succeeded
+        yet. Tasks which already succeeded end the walk unless their output
+        has been released.
 
-    def as_dict(self):
-        return self.__dict__
+        Raises:
+            Exception when task cannot be find in registered tasks
+        """
+        required: typing.Dict[str, None] = {}
+        stack = list(tasks)
+        while stack:
+            t = stack.pop()
+            if t in required:
+                continue
+            self._validate_task_names([t])
+            if self._has_succeeded(t) and not self._states[t].is_released():
+                continue
+            required[t] = None
+            stack.extend(self._dependencies(t))
+        return list(required)
+
+    def get_outputs(
+        self, tasks: typing.List[str], **kwargs
+    ) -> typing.Dict[str, typing.Any]:
+        """
+        Runs the given tasks and only the tasks they (transitively) depend
+        on, concurrently like run_tasks_parallel(), and returns the outputs
+        of the given tasks. Tasks which already succeeded in this context
+        are not run again unless their output has been released. The
+        outputs of the given tasks are not released by the run.
+
+        Returns:
+            task name -> output for the given tasks
+
+        Raises:
+            TaskFailedError when a task fails, after rolling back
+            Exception when task cannot be find in registered tasks
+        """
+        required = self._required_tasks(tasks)
+        for t in required:
+            state = self._states.get(t)
+            if state is not None and state.is_released():
+                state.flush()
+        self._start_run(MODE_PARALLEL, required, retain=tasks)
+        try:
+            self._run_tasks_parallel(required, **kwargs)
+        except Exception:
+            self._rollback_dependencies(**kwargs)
+            self._finish_run()
+            raise
+        self._finish_run()
+        return {t: self._get_output_for(t) for t in tasks}
+
+    def get_result(self):
+        result = TaskManagerResult()
+        for t, task in self._tasks.items():
+            state = self._states.get(t)
+            if state is None or not state.has_run():
+                continue
+            task_name = task.action.__name__
+            if state.is_success():
+                result.tasks_success.append(task_name)
+                continue
+            result.tasks_failed.append(task_name)
+            result.exceptions.append(state.get_exception())
+        if self._instrument:
+            for t, state in self._states.items():
+                if state.timing is not None and state.has_run():
+                    result.timings[t] = state.timing
+                    if t in self._tasks:
+                        result.dependencies[t] = self._dependencies(t)
+            result.rollback_tasks = list(self._on_rollback)
+        result.peak_output_bytes = self._peak_output_bytes
+        return result
 
 
 class TaskManager:
@@ -191,16 +3121,110 @@ class TaskManager:
     # lets flush tasks because our TaskManager() is a global instance
     # after flushing we can start over with all the task outputs cleared
     tm.flush_tasks()
+
+    Run state lives in a RunContext: run_tasks() and friends use the
+    manager's default context while new_context() returns an independent
+    one. Tasks can also be run concurrently with run_tasks_parallel() and
+    run_tasks_async(); the options of the manager are described on
+    __init__() and those of a task on Task.__init__().
     """
 
-    def __init__(self):
+    def __init__(
+        self,
+        max_workers: typing.Optional[int] = None,
+        max_processes: typing.Optional[int] = None,
+        cache=None,
+        journal: typing.Optional[Journal] = None,
+        rollback_workers: int = 1,
+        instrument=False,
+        infer_dependencies=False,
+        eager=False,
+        output_timeout: typing.Optional[float] = None,
+        release_outputs=False,
+        spill: typing.Optional[SpillStore] = None,
+        shared_memory: typing.Optional[int] = None,
+        run_timeout: typing.Optional[float] = None,
+    ):
+        """
+        Arguments:
+            max_workers: int - thread pool size of concurrent runs
+            max_processes: int - process pool size for process tasks
+            cache - cache of tasks registered with cache=True, a MemoryCache
+                by default or a DiskCache shared by processes
+            journal: Journal - writes every completed task to disk so an
+                interrupted run can be continued with resume()
+            rollback_workers: int - rollback tasks run at a time after a
+                concurrent run failed, in reverse dependency order
+            instrument: bool - records a TaskTiming of every task and
+                rollback task in get_result().timings
+            infer_dependencies: bool - records the outputs each task reads
+                in inferred_dependencies, concurrent runs treat them like
+                depends_on
+            eager: bool - starts tasks which use outputs right away in
+                concurrent runs, get_output_for() waits for the producer
+            output_timeout: float - seconds get_output_for() waits for an
+                unfinished task before raising OutputNotAvailableError
+            release_outputs: bool - drops outputs once every task of the
+                run reading them has succeeded
+            spill: SpillStore - writes the largest outputs to files when
+                the outputs kept by a run exceed its max_bytes
+            shared_memory: int - outputs with buffers of at least this many
+                bytes are handed to process tasks in shared memory
+            run_timeout: float - seconds every run may take before its
+                remaining tasks fail with TaskTimeoutError
+        """
         # Task store for registered tasks
         self.tasks: typing.Dict[str, Task] = {}
-        # Store for rollback actions in case we need to use them
-        self._on_rollback: typing.List[str] = []
+        # Thread pool size for run_tasks_parallel (None = executor default)
+        self._max_workers = max_workers
+        # Process pool size for process tasks (None = executor default)
+        self._max_processes = max_processes
+        # Cache for outputs of tasks registered with cache=True
+        self.cache = MemoryCache() if cache is None else cache
+        # Tasks whose outputs each cached task read on its last run
+        self._cache_reads: typing.Dict[str, typing.Tuple[str, ...]] = {}
+        # Write-ahead journal of completed tasks for resume()
+        self.journal = journal
+        # Number of rollback tasks run concurrently after a failed
+        # run_tasks_parallel() or run_tasks_async()
+        self._rollback_workers = rollback_workers
+        # Record a TaskTiming for every task run (see get_result().timings)
+        self._instrument = instrument
+        # Record which outputs every task reads as inferred dependencies
+        self._infer_dependencies = infer_dependencies
+        # task name -> tasks whose outputs it read on its last run
+        self.inferred_dependencies: typing.Dict[str, typing.Tuple[str, ...]] = {}
+        # Start tasks which use outputs before their upstream tasks finished
+        self._eager = eager
+        # Seconds get_output_for waits for an unfinished task (None = no limit)
+        self._output_timeout = output_timeout
+        # Drop outputs once the tasks reading them in a run have succeeded
+        self._release_outputs = release_outputs
+        # Store for outputs exceeding the memory budget (None = keep all)
+        self.spill = spill
+        # Outputs with buffers of at least this many bytes are handed to
+        # process tasks in shared memory (None = always pickled)
+        self._shared_memory = shared_memory
+        # Seconds every run may take before its remaining tasks fail with
+        # TaskTimeoutError (None = no limit)
+        self._run_timeout = run_timeout
+        # Default run context which stores its state in the registered tasks
+        self._states: typing.Dict[str, TaskState] = {}
+        self.context = RunContext(self, states=self._states)
+
+    @property
+    def _on_rollback(self) -> RollbackStack:
+        """
+        rollback tasks registered in the default run context
+        """
+        return self.context.rollback_stack
 
     def _register(self, task_name: str, task: Task):
         self.tasks[task_name] = task
+        # the default context keeps its states in the registered tasks
+        # pylint: disable-next=protected-access
+        task.state._attach(self.context._epoch)
+        self._states[task_name] = task.state
 
     def flush_tasks(self):
         """
@@ -214,8 +3238,61 @@ class TaskManager:
         ...running tasks...and then...
         tm.flush_tasks()
         """
-        for t in self.tasks:
-            self.tasks[t].flush()
+        self.context.flush()
+
+    def new_context(self) -> "RunContext":
+        """
+        Returns a new, empty run context for running the registered tasks
+        independently of other runs.
+        """
+        return RunContext(self)
+
+    def _resume_context(self, run_id: str) -> typing.Tuple["RunContext", typing.Any]:
+        if self.journal is None:
+            raise Exception("resume requires a TaskManager with a journal")
+        entry = self.journal.load(run_id)
+        if entry.rolled_back:
+            raise Exception(
+                f"Run '{run_id}' has been rolled back, it cannot be resumed"
+            )
+        return RunContext(self, run_id=run_id, outputs=entry.outputs), entry
+
+    def resume(self, run_id: str, **kwargs) -> "RunContext":
+        """
+        Resumes an interrupted run from the journal: tasks which succeeded
+        get their outputs back and only the remaining tasks are run.
+
+        Arguments:
+            run_id: str - RunContext.run_id of the interrupted run
+            **kwargs - keyword arguments passed to the tasks
+
+        Raises:
+            Exception when there is no journal or the run was rolled back
+            FileNotFoundError when the run is not in the journal
+        """
+        context, entry = self._resume_context(run_id)
+        for mode, tasks in entry.runs:
+            if mode == MODE_ASYNC:
+                raise Exception(f"Run '{run_id}' was async, use resume_async()")
+            if mode == MODE_PARALLEL:
+                context.run_tasks_parallel(tasks, **kwargs)
+            else:
+                context.run_tasks(tasks, **kwargs)
+        return context
+
+    async def resume_async(self, run_id: str, **kwargs) -> "RunContext":
+        """
+        Like resume() but async runs are resumed on the event loop
+        """
+        context, entry = self._resume_context(run_id)
+        for mode, tasks in entry.runs:
+            if mode == MODE_ASYNC:
+                await context.run_tasks_async(tasks, **kwargs)
+            elif mode == MODE_PARALLEL:
+                context.run_tasks_parallel(tasks, **kwargs)
+            else:
+                context.run_tasks(tasks, **kwargs)
+        return context
 
     def register_task(self, function: typing.Callable, **kwargs):
         """
@@ -225,10 +3302,75 @@ class TaskManager:
         function: typing.Callable[] - function to be used as a task
         **kwargs - keyword arguments to be passed to the Task() on __init__()
         """
+        task = Task(action=function, **kwargs)
+        self._register(task_name=function.__name__, task=task)
+        if task.rollback:
+            self._register_rollback_task(
+                function=task.rollback,
+                rollback_uses_output=task.rollback_uses_output(),
+            )
+
+    def _register_rollback_task(
+        self, function: typing.Callable, rollback_uses_output, **kwargs
+    ):
+        """
+        Registers a rollback task.
+        """
         self._register(
-            task_name=function.__name__, task=Task(action=function, **kwargs)
+            task_name=function.__name__,
+            task=Task(action=function, uses_output=rollback_uses_output, **kwargs),
         )
 
+    def save_inferred_dependencies(self, path: str):
+        """
+        Writes the inferred dependency graph to a JSON file
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {t: list(reads) for t, reads in self.inferred_dependencies.items()},
+                f,
+                indent=2,
+            )
+
+    def load_inferred_dependencies(self, path: str):
+        """
+        Reads an inferred dependency graph written by
+        save_inferred_dependencies(), e.g. by an earlier process
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            self.inferred_dependencies.update(
+                {t: tuple(reads) for t, reads in json.load(f).items()}
+            )
+
+    def compile(self, tasks: typing.List[str]) -> ExecutionPlan:
+        """
+        Validates the tasks and resolves them into a plan which can be
+        run repeatedly with little overhead.
+
+        Raises:
+            Exception when task cannot be find in registered tasks
+        """
+        return ExecutionPlan(self, tasks)
+
+    def run_many(
+        self,
+        tasks: typing.List[str],
+        inputs: typing.Iterable[typing.Dict[str, typing.Any]],
+        concurrency: int = 1,
+    ) -> typing.Iterator[RunOutcome]:
+        """
+        Compiles the tasks once and runs them for every dict of keyword
+        arguments in inputs. Read docs from ExecutionPlan.run_many for
+        more information.
+
+        Usage example:
+
+        for outcome in tm.run_many(["parse", "store"], records, concurrency=8):
+            if outcome.exception is not None:
+                print(f"record {outcome.position} failed: {outcome.exception}")
+        """
+        return self.compile(tasks).run_many(inputs, concurrency)
+
     def task(self, **kwargs):
         """
         This method is like register_task() but it is used
@@ -252,119 +3394,52 @@ class TaskManager:
 
         return wrapper
 
-    def _get_output_for(self, task_name: str) -> typing.Any:
+    def get_output_for(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
         """
-        Returns output from the selected task.
-
-        Arguments:
-            task_name: str - Name/Identifier of the task
-
-        Returns:
-            typing.Any (Output can be anything)
-
-        Raises:
-            Re-raises the original exception
-            KeyError when task cannot be find in registered tasks
+        Returns output from the selected task in the default run context
         """
-        try:
-            selected = self.tasks[task_name]
-            if not selected.has_run():
-                raise OutputNotAvailableError(
-                    f"{task_name} has not run therefore its output is not available."
-                )
-            return selected.get_output()
-        except KeyError as e:
-            raise Exception(
-                f"_get_output_for could not find '{task_name}' from registered tasks"
-            ) from e
+        return self.context.get_output_for(task_name, timeout)
 
-    def get_output_for(self, task_name: str) -> typing.Any:
+    async def get_output_for_async(
+        self, task_name: str, timeout: typing.Optional[float] = None
+    ) -> typing.Any:
         """
-        public method for _get_output_for()
+        Awaitable get_output_for() in the default run context
         """
-        return self._get_output_for(task_name)
+        return await self.context.get_output_for_async(task_name, timeout)
 
-    def _register_rollback_task(
-        self, function: typing.Callable, rollback_uses_output, **kwargs
-    ):
+    def run_tasks(self, tasks: typing.List[str], **kwargs) -> "RunContext":
         """
-        Registers a rollback task.
+        Runs tasks in the default run context. Read docs from
+        RunContext._run_tasks for more information.
         """
-        self.register_task(function, uses_output=rollback_uses_output, **kwargs)
-        # add unique (by name) rollback tasks only
-        if not function.__name__ in self._on_rollback:
-            self._on_rollback.insert(0, function.__name__)
+        return self.context.run_tasks(tasks, **kwargs)
 
-    def _rollback_dependencies(self, **kwargs):
+    def run_tasks_parallel(self, tasks: typing.List[str], **kwargs) -> "RunContext":
         """
-        Rollback dependency tasks
+        Runs tasks concurrently in the default run context. Read docs
+        from RunContext._run_tasks_parallel for more information.
         """
-        self._run_tasks(self._on_rollback, **kwargs)
+        return self.context.run_tasks_parallel(tasks, **kwargs)
 
-    def _run_tasks(self, tasks: typing.List[str], **kwargs):
+    async def run_tasks_async(self, tasks: typing.List[str], **kwargs) -> "RunContext":
         """
-        Runs tasks and registers their rollback tasks.
-
-        Arguments:
-            tasks: Callable[str] - list of task names
-
-        Returns:
-            N/A
-
-        Raises:
-            Re-raises the original exception
-            KeyError when task cannot be find in registered tasks
+        Runs tasks on the event loop in the default run context. Read docs
+        from RunContext._run_tasks_async for more information.
         """
-        # current_task = None
-        # Validate task names first
-        for t in tasks:
-            try:
-                self.tasks[t]
-            except KeyError as e:
-                raise Exception(f"Unknown task '{t}'. Check registered tasks") from e
-        # Run tasks
-        for t in tasks:
-            try:
-                current_task = self.tasks[t]
-                if current_task.has_run() and current_task.is_success():
-                    continue
-                if current_task.uses_output():
-                    current_task.run(get_output_for=self._get_output_for, **kwargs)
-                else:
-                    current_task.run(**kwargs)
-                if not current_task.is_success():
-                    raise TaskFailedError(f"Task '{t}' has been tagged non successful")
-                # Register rollback task only if current task was run succesfully
-                # we dont need to rollback the current task because it failed
-                if current_task.rollback:
-                    self._register_rollback_task(
-                        function=current_task.rollback,
-                        rollback_uses_output=current_task.rollback_uses_output(),
-                    )
-            except Exception as e:
-                raise TaskFailedError(f"Task '{t}' failed") from e
+        return await self.context.run_tasks_async(tasks, **kwargs)
 
-    def run_tasks(self, tasks: typing.List[str], **kwargs):
+    def get_outputs(
+        self, tasks: typing.List[str], **kwargs
+    ) -> typing.Dict[str, typing.Any]:
         """
-        Public method for running tasks. Read docs from _run_tasks
+        Runs the tasks and what they depend on in the default run context
+        and returns their outputs. Read docs from RunContext.get_outputs
         for more information.
         """
-        try:
-            self._run_tasks(tasks, **kwargs)
-        except Exception:
-            self._rollback_dependencies(**kwargs)
-            raise
+        return self.context.get_outputs(tasks, **kwargs)
 
     def get_result(self):
-        result = TaskManagerResult()
-        for t in self.tasks:
-            task = self.tasks[t]
-            task_name = task.action.__name__
-            if not task.has_run():
-                continue
-            if task.is_success():
-                result.tasks_success.append(task_name)
-                continue
-            result.tasks_failed.append(task_name)
-            result.exceptions.append(task.get_exception())
-        return result
+        return self.context.get_result()
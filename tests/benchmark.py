@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for task_manager.py
+
+Measures the overhead TaskManager adds per task (ns) for registering,
+running, get_result() and flush_tasks() on synthetic graphs (chains,
+wide fan-outs and random DAGs), runs that fail and roll back, memory
+per task and how they scale with the number of tasks.
+
+Run from the repository root:
+
+    python -m tests.benchmark
+    python -m tests.benchmark --max-tasks 1000000
+    python -m tests.benchmark --save baseline.json
+    python -m tests.benchmark --compare baseline.json --threshold 0.25
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import typing
+
+from task_manager import TaskManager, TaskFailedError
+from task_manager.task_manager import EXECUTOR_INLINE
+
+Graph = typing.List[typing.Tuple[str, typing.Tuple[str, ...]]]
+# {benchmark: {operation: {task count: value}}}
+Results = typing.Dict[str, typing.Dict[str, typing.Dict[str, float]]]
+
+
+def _make_function(name: str, fails=False):
+    def function(**kwargs):
+        if fails:
+            raise ValueError(name)
+        return None
+
+    function.__name__ = name
+    return function
+
+
+def chain(count: int) -> Graph:
+    """
+    task{i} depends on task{i-1}
+    """
+    return [(f"task{i}", (f"task{i - 1}",) if i else ()) for i in range(count)]
+
+
+def fan_out(count: int) -> Graph:
+    """
+    every task depends on task0
+    """
+    return [(f"task{i}", ("task0",) if i else ()) for i in range(count)]
+
+
+def random_dag(count: int, seed=0, max_parents=3, window=100) -> Graph:
+    """
+    every task depends on up to max_parents of the window tasks before it
+    """
+    rng = random.Random(seed)
+    graph = []
+    for i in range(count):
+        candidates = range(max(0, i - window), i)
+        size = min(len(candidates), rng.randint(0, max_parents))
+        parents = sorted(rng.sample(candidates, size))
+        graph.append((f"task{i}", tuple(f"task{p}" for p in parents)))
+    return graph
+
+
+GRAPHS = {"chain": chain, "fan_out": fan_out, "random_dag": random_dag}
+
+
+def build(
+    graph: Graph,
+    with_rollback=False,
+    failing: typing.Optional[str] = None,
+    **options,
+) -> TaskManager:
+    """
+    Registers a trivial inline task for every node of the graph
+    """
+    task_manager = TaskManager(**options)
+    for name, depends_on in graph:
+        task_manager.register_task(
+            _make_function(name, fails=name == failing),
+            uses_output=False,
+            depends_on=depends_on,
+            executor=EXECUTOR_INLINE,
+            rollback=_make_function(f"rollback_{name}") if with_rollback else None,
+            rollback_uses_output=False,
+        )
+    return task_manager
+
+
+def build_chain(count: int, with_rollback=True) -> TaskManager:
+    """
+    Registers count trivial tasks, each with its own rollback task
+    """
+    return build(chain(count), with_rollback=with_rollback)
+
+
+def _timed(function: typing.Callable[[], typing.Any]) -> float:
+    """
+    Returns seconds spent in function with the garbage collector disabled
+    (like timeit) so collections triggered by earlier runs do not add noise
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        function()
+        return time.perf_counter() - started
+    finally:
+        gc.enable()
+
+
+def bench_graph(kind: str, count: int) -> typing.Dict[str, float]:
+    """
+    Returns ns per task of registering, run_tasks(), get_result(),
+    flush_tasks(), run_tasks_parallel() (inline tasks, i.e. scheduling
+    overhead only) and a compiled plan for a graph
+    """
+    graph = GRAPHS[kind](count)
+    names = [name for name, _ in graph]
+    managers: typing.List[TaskManager] = []
+    seconds = {"register": _timed(lambda: managers.append(build(graph)))}
+    task_manager = managers[0]
+    seconds["run_tasks"] = _timed(lambda: task_manager.run_tasks(names))
+    seconds["get_result"] = _timed(task_manager.get_result)
+    seconds["flush_tasks"] = _timed(task_manager.flush_tasks)
+    seconds["run_tasks_parallel"] = _timed(
+        lambda: task_manager.run_tasks_parallel(names)
+    )
+    seconds["compiled_plan"] = _timed(task_manager.compile(names).run)
+    return {op: value / count * 1e9 for op, value in seconds.items()}
+
+
+def bench_rollback(count: int) -> typing.Dict[str, float]:
+    """
+    Returns ns per task of runs whose last task fails after every other
+    task registered a rollback: a chain rolled back serially and a
+    fan-out rolled back in parallel
+    """
+    results = {}
+    for kind, options in (("chain", {}), ("fan_out", {"rollback_workers": 4})):
+        graph = GRAPHS[kind](count)
+        names = [name for name, _ in graph]
+        task_manager = build(graph, with_rollback=True, failing=names[-1], **options)
+        run = (
+            task_manager.run_tasks
+            if kind == "chain"
+            else task_manager.run_tasks_parallel
+        )
+
+        def fail():
+            try:
+                run(names)
+            except TaskFailedError:
+                pass
+
+        results[f"{kind}_failure"] = _timed(fail) / count * 1e9
+    return results
+
+
+def bench_memory(kind: str, count: int) -> typing.Dict[str, float]:
+    """
+    Returns bytes per task still allocated after registering a graph
+    (tasks, states and their actions) and in addition after running it
+    (outputs, inputs and rollback bookkeeping)
+    """
+    graph = GRAPHS[kind](count)
+    names = [name for name, _ in graph]
+    gc.collect()
+    # the graph description is allocated before tracing started
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        task_manager = build(graph, with_rollback=True)
+        registered, _ = tracemalloc.get_traced_memory()
+        task_manager.run_tasks(names)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del task_manager
+    return {
+        f"{kind}_registered": (registered - baseline) / count,
+        f"{kind}_run": (current - registered) / count,
+    }
+
+
+def bench_compiled_plan(count: int, repeat: int) -> typing.Tuple[float, float]:
+    """
+    Returns seconds per run of count tasks for run_tasks() in new contexts
+    and for a compiled plan
+    """
+    task_manager = build_chain(count, with_rollback=False)
+    names = [f"task{i}" for i in range(count)]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        task_manager.new_context().run_tasks(names)
+    uncompiled = (time.perf_counter() - started) / repeat
+    plan = task_manager.compile(names)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        plan.run()
+    return uncompiled, (time.perf_counter() - started) / repeat
+
+
+def bench_instrumentation(count: int) -> typing.Tuple[float, float]:
+    """
+    Returns seconds per task of a compiled plan with and without timings
+    """
+    results = []
+    for instrument in (False, True):
+        task_manager = TaskManager(instrument=instrument)
+        for i in range(count):
+            task_manager.register_task(_make_function(f"task{i}"), uses_output=False)
+        plan = task_manager.compile([f"task{i}" for i in range(count)])
+        started = time.perf_counter()
+        plan.run()
+        results.append((time.perf_counter() - started) / count)
+    return results[0], results[1]
+
+
+def _sizes(max_tasks: int, min_tasks=10):
+    size = min_tasks
+    while size <= max_tasks:
+        yield size
+        size *= 10
+
+
+def run(max_tasks: int, min_tasks=10, repeat=3) -> Results:
+    """
+    Runs all benchmarks repeat times and keeps the best value of each
+    measurement. Time values are ns per task, memory values bytes per task.
+    """
+    results: Results = {}
+
+    def add(benchmark: str, count: int, values: typing.Dict[str, float]):
+        for op, value in values.items():
+            measured = results.setdefault(benchmark, {}).setdefault(op, {})
+            measured[str(count)] = min(value, measured.get(str(count), value))
+
+    for count in _sizes(max_tasks, min_tasks):
+        for _ in range(repeat):
+            for kind in GRAPHS:
+                add(kind, count, bench_graph(kind, count))
+            add("rollback", count, bench_rollback(count))
+        for kind in GRAPHS:
+            add("memory", count, bench_memory(kind, count))
+        print(f"measured {count} tasks", file=sys.stderr)
+
+    for _ in range(repeat):
+        uncompiled, compiled = bench_compiled_plan(10, repeat=10000)
+        add("plan", 10, {"run_tasks": uncompiled * 1e8, "compiled": compiled * 1e8})
+        count = min(max_tasks, 100000)
+        disabled, enabled = bench_instrumentation(count)
+        add("instrument", count, {"disabled": disabled * 1e9, "enabled": enabled * 1e9})
+    return results
+
+
+def report(results: Results):
+    """
+    Prints a table per benchmark with a column per task count and the
+    growth of the per-task cost from the smallest to the largest run
+    """
+    for benchmark, operations in results.items():
+        unit = "bytes/task" if benchmark == "memory" else "ns/task"
+        counts = sorted({int(c) for values in operations.values() for c in values})
+        print(f"\n{benchmark} ({unit})")
+        header = "".join(f"{c:>12}" for c in counts)
+        print(f"{'':>24}{header}" + (f"{'growth':>10}" if len(counts) > 1 else ""))
+        for op, values in operations.items():
+            measured = [values[str(c)] for c in counts if str(c) in values]
+            row = "".join(
+                f"{values[str(c)]:>12.0f}" if str(c) in values else f"{'':>12}"
+                for c in counts
+            )
+            # linear scaling keeps the cost per task roughly constant
+            growth = ""
+            if len(measured) > 1 and measured[0]:
+                growth = f"{measured[-1] / measured[0]:>9.2f}x"
+            print(f"{op:>24}{row}{growth}")
+
+
+def compare(results: Results, baseline: Results, threshold: float) -> typing.List[str]:
+    """
+    Returns a line for every measurement which is more than threshold
+    (relative) higher than in the baseline
+    """
+    regressions = []
+    for benchmark, operations in results.items():
+        for op, values in operations.items():
+            for count, value in values.items():
+                previous = baseline.get(benchmark, {}).get(op, {}).get(count)
+                if previous and value > previous * (1 + threshold):
+                    regressions.append(
+                        f"{benchmark}.{op}[{count}]: {previous:.0f} -> {value:.0f}"
+                        f" (+{(value / previous - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--max-tasks", type=int, default=100000)
+    parser.add_argument("--min-tasks", type=int, default=10)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per measurement, best is kept"
+    )
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--compare", help="compare with results saved by --save")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="relative increase reported as a regression (default 0.25)",
+    )
+    args = parser.parse_args(argv)
+
+    results = run(args.max_tasks, args.min_tasks, args.repeat)
+    report(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(
+                {"python": platform.python_version(), "results": results}, f, indent=2
+            )
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"regression {line}")
+        if regressions:
+            return 1
+        print(f"\nno regressions above {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
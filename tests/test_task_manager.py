@@ -1,7 +1,81 @@
 #!/usr/bin/env python3
+import array
+import asyncio
+import concurrent.futures
+import gc
+import json
+import multiprocessing
+import os
+import pickle
+import tempfile
+import sys
+import threading
+import time
 import unittest
 
-from task_manager import TaskManager
+from task_manager import (
+    TaskManager,
+    TaskFailedError,
+    OutputNotAvailableError,
+    RollbackStack,
+    TaskTimeoutError,
+)
+from task_manager.cache import MemoryCache, DiskCache
+from task_manager.journal import Journal
+from task_manager.store import SharedOutput, SpillStore, release_segments, share
+
+# Functions and classes run in or sent to process tasks are defined at
+# module level so they can be pickled
+
+
+def square(value):
+    return value * value
+
+
+def process_id(get_output_for, value):
+    return os.getpid(), get_output_for("square")
+
+
+def summarize_outputs(get_output_for):
+    return [
+        (type(get_output_for(name)).__name__, len(get_output_for(name)))
+        for name in ("blob", "raw", "numbers")
+    ]
+
+
+if sys.version_info >= (3, 8):
+
+    class BufferView:
+        """
+        keeps a view of its buffer like a NumPy array
+        """
+
+        def __init__(self, data):
+            self.data = memoryview(data)
+
+        def __reduce_ex__(self, protocol):
+            return BufferView, (pickle.PickleBuffer(self.data),)
+
+
+def buffer_view_size(get_output_for):
+    return get_output_for("view").data.nbytes
+
+
+def write_disk_cache(directory, keys):
+    with DiskCache(directory) as cache:
+        for key in keys:
+            cache.set(key, {"key": key})
+
+
+def read_disk_cache(directory, keys):
+    with DiskCache(directory) as cache:
+        return [cache.get(key, None) for key in keys]
+
+
+def hang_in_process(pid_file):
+    with open(pid_file, "w", encoding="utf-8") as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
 
 
 class TaskManagerTests(unittest.TestCase):
@@ -14,3 +88,1401 @@ class TaskManagerTests(unittest.TestCase):
         test initialize taskmanager
         """
         task_manager = TaskManager()
+
+    def test_run_tasks_parallel_respects_dependencies(self):
+        """
+        test independent tasks overlap and dependants see upstream outputs
+        """
+        task_manager = TaskManager(max_workers=3)
+        barrier = threading.Barrier(3, timeout=5)
+
+        def make_fetch(value):
+            def fetch():
+                # all three fetches must run at the same time to pass the barrier
+                barrier.wait()
+                return value
+
+            fetch.__name__ = f"fetch{value}"
+            return fetch
+
+        for value in (1, 2, 3):
+            task_manager.register_task(make_fetch(value), uses_output=False)
+
+        @task_manager.task(depends_on=["fetch1", "fetch2", "fetch3"])
+        def aggregate(get_output_for):
+            return sum(get_output_for(f"fetch{i}") for i in (1, 2, 3))
+
+        task_manager.run_tasks_parallel(["aggregate", "fetch1", "fetch2", "fetch3"])
+        self.assertEqual(task_manager.get_output_for("aggregate"), 6)
+
+    def test_run_tasks_parallel_rolls_back_on_failure(self):
+        """
+        test failure stops dependants and rolls back succeeded tasks
+        """
+        task_manager = TaskManager()
+        rolled_back = []
+
+        def first_rollback():
+            rolled_back.append("first")
+
+        @task_manager.task(
+            uses_output=False, rollback=first_rollback, rollback_uses_output=False
+        )
+        def first():
+            return 1
+
+        @task_manager.task(uses_output=False, depends_on=["first"])
+        def second():
+            raise ValueError("fails")
+
+        @task_manager.task(uses_output=False, depends_on=["second"])
+        def third():
+            return 3
+
+        with self.assertRaises(TaskFailedError):
+            task_manager.run_tasks_parallel(["first", "second", "third"])
+        self.assertEqual(rolled_back, ["first"])
+        self.assertFalse(task_manager.tasks["third"].has_run())
+
+    def test_run_tasks_parallel_detects_cycles(self):
+        """
+        test dependency cycles are rejected before anything runs
+        """
+        task_manager = TaskManager()
+
+        @task_manager.task(uses_output=False, depends_on=["second"])
+        def first():
+            return 1
+
+        @task_manager.task(uses_output=False, depends_on=["first"])
+        def second():
+            return 2
+
+        with self.assertRaises(Exception):
+            task_manager.run_tasks_parallel(["first", "second"])
+        self.assertFalse(task_manager.tasks["first"].has_run())
+
+    def test_run_tasks_async_runs_coroutines_concurrently(self):
+        """
+        test coroutine tasks overlap on the event loop and outputs can be awaited
+        """
+        task_manager = TaskManager()
+        started = []
+
+        @task_manager.task(uses_output=False)
+        async def fetch1():
+            started.append("fetch1")
+            await asyncio.sleep(0)
+            # fetch2 has started while fetch1 was suspended
+            return started[:]
+
+        @task_manager.task(uses_output=False)
+        async def fetch2():
+            started.append("fetch2")
+            return 2
+
+        @task_manager.task()
+        async def aggregate(get_output_for):
+            # no depends_on: awaiting get_output_for waits for the producer
+            return len(await get_output_for("fetch1")) + await get_output_for("fetch2")
+
+        asyncio.run(task_manager.run_tasks_async(["aggregate", "fetch1", "fetch2"]))
+        self.assertEqual(task_manager.get_output_for("aggregate"), 4)
+
+    def test_run_tasks_async_awaits_rollbacks(self):
+        """
+        test coroutine rollbacks are awaited when a task fails
+        """
+        task_manager = TaskManager()
+        rolled_back = []
+
+        async def first_rollback():
+            rolled_back.append("first")
+
+        @task_manager.task(
+            uses_output=False, rollback=first_rollback, rollback_uses_output=False
+        )
+        async def first():
+            return 1
+
+        @task_manager.task(uses_output=False, depends_on=["first"])
+        async def second():
+            raise ValueError("fails")
+
+        with self.assertRaises(TaskFailedError):
+            asyncio.run(task_manager.run_tasks_async(["first", "second"]))
+        self.assertEqual(rolled_back, ["first"])
+
+    def test_run_tasks_async_detects_waits_which_never_end(self):
+        """
+        test coroutines awaiting the output of a task which waits for
+        them raise instead of hanging
+        """
+        task_manager = TaskManager()
+
+        @task_manager.task()
+        async def first(get_output_for):
+            return await get_output_for("second")
+
+        @task_manager.task(depends_on=["first"])
+        async def second(get_output_for):
+            return 1
+
+        @task_manager.task()
+        async def ping(get_output_for):
+            await asyncio.sleep(0.01)
+            return await get_output_for("pong")
+
+        @task_manager.task()
+        async def pong(get_output_for):
+            await asyncio.sleep(0.02)
+            return await get_output_for("ping")
+
+        for tasks in (["first", "second"], ["ping", "pong"]):
+            task_manager.flush_tasks()
+            with self.assertRaises(TaskFailedError) as failure:
+                asyncio.run(asyncio.wait_for(task_manager.run_tasks_async(tasks), 5))
+            self.assertIn("cycle", str(failure.exception.__cause__))
+
+    def test_executor_selection(self):
+        """
+        test process, thread and inline tasks in a single parallel run
+        """
+        task_manager = TaskManager(max_processes=2)
+        task_manager.register_task(square, executor="process", uses_output=False)
+        task_manager.register_task(
+            process_id, executor="process", depends_on=["square"]
+        )
+
+        @task_manager.task(executor="inline", depends_on=["square", "process_id"])
+        def combine(get_output_for, **kwargs):
+            return get_output_for("square"), get_output_for("process_id")[0]
+
+        task_manager.run_tasks_parallel(["square", "process_id", "combine"], value=7)
+        output, worker_pid = task_manager.get_output_for("combine")
+        self.assertEqual(output, 49)
+        self.assertNotEqual(worker_pid, os.getpid())
+        self.assertEqual(task_manager.get_output_for("process_id")[1], 49)
+
+    def test_run_tasks_runs_process_tasks_in_the_pool(self):
+        """
+        test run_tasks, compiled plans and run_many run process tasks in
+        a worker process
+        """
+        task_manager = TaskManager(max_processes=1)
+        task_manager.register_task(square, executor="process", uses_output=False)
+        task_manager.register_task(
+            process_id, executor="process", depends_on=["square"]
+        )
+        tasks = ["square", "process_id"]
+        contexts = [
+            task_manager.new_context().run_tasks(tasks, value=3),
+            task_manager.compile(tasks).run(value=3),
+        ] + [o.context for o in task_manager.run_many(tasks, [{"value": 3}])]
+        for context in contexts:
+            worker_pid, output = context.get_output_for("process_id")
+            self.assertNotEqual(worker_pid, os.getpid())
+            self.assertEqual(output, 9)
+
+    def test_unknown_executor_is_rejected(self):
+        """
+        test executor must be inline, thread or process
+        """
+        task_manager = TaskManager()
+        with self.assertRaises(ValueError):
+            task_manager.register_task(square, executor="gpu")
+
+    def test_run_contexts_are_isolated(self):
+        """
+        test concurrent runs of the same tasks in separate contexts
+        """
+        task_manager = TaskManager()
+
+        @task_manager.task(uses_output=False)
+        def double(value):
+            return value * 2
+
+        @task_manager.task(depends_on=["double"])
+        def increment(get_output_for, value):
+            return get_output_for("double") + 1
+
+        def run(value):
+            context = task_manager.new_context()
+            return context.run_tasks(["double", "increment"], value=value)
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            contexts = list(executor.map(run, range(100)))
+
+        for value, context in enumerate(contexts):
+            self.assertEqual(context.get_output_for("increment"), value * 2 + 1)
+            self.assertEqual(
+                context.get_result().tasks_success, ["double", "increment"]
+            )
+        # the default context was never used
+        self.assertFalse(task_manager.tasks["double"].has_run())
+        with self.assertRaises(OutputNotAvailableError):
+            task_manager.get_output_for("double")
+
+    def test_run_tasks_returns_default_context(self):
+        """
+        test run_tasks runs in the default context which flush_tasks clears
+        """
+        task_manager = TaskManager()
+
+        @task_manager.task(uses_output=False)
+        def first():
+            return 1
+
+        context = task_manager.run_tasks(["first"])
+        self.assertIs(context, task_manager.context)
+        self.assertTrue(task_manager.tasks["first"].has_run())
+        task_manager.flush_tasks()
+        self.assertFalse(context.has_run("first"))
+
+    def test_rollback_stack_order(self):
+        """
+        test rollback tasks are unique and most recent first
+        """
+        stack = RollbackStack()
+        for name in ("first", "second", "first", "third"):
+            stack.push(name)
+        self.assertEqual(list(stack), ["third", "second", "first"])
+        self.assertIn("second", stack)
+        self.assertEqual(len(stack), 3)
+
+    def test_compiled_plan_runs_repeatedly(self):
+        """
+        test a compiled plan runs in a new context every time
+        """
+        task_manager = TaskManager()
+        rolled_back = []
+
+        def first_rollback(value):
+            rolled_back.append(value)
+
+        @task_manager.task(
+            uses_output=False, rollback=first_rollback, rollback_uses_output=False
+        )
+        def first(value):
+            return value
+
+        @task_manager.task()
+        def second(get_output_for, value):
+            if value < 0:
+                raise ValueError("negative")
+            return get_output_for("first") * 2
+
+        plan = task_manager.compile(["first", "second"])
+        self.assertEqual(plan.rollback_order, ("first_rollback",))
+        for value in range(3):
+            self.assertEqual(plan.run(value=value).get_output_for("second"), value * 2)
+        with self.assertRaises(TaskFailedError):
+            plan.run(value=-1)
+        self.assertEqual(rolled_back, [-1])
+
+    def test_compiled_plan_runs_tasks_like_run_tasks(self):
+        """
+        test compiled plans record inferred dependencies like run_tasks
+        """
+        task_manager = TaskManager(infer_dependencies=True)
+
+        @task_manager.task(uses_output=False)
+        def first():
+            return 1
+
+        @task_manager.task()
+        def second(get_output_for):
+            return get_output_for("first") + 1
+
+        context = task_manager.compile(["first", "second"]).run()
+        self.assertEqual(context.get_output_for("second"), 2)
+        self.assertEqual(task_manager.inferred_dependencies["second"], ("first",))
+
+    def test_compile_rejects_unknown_tasks(self):
+        """
+        test compiling validates task names
+        """
+        task_manager = TaskManager()
+        with self.assertRaises(Exception):
+            task_manager.compile(["missing"])
+
+    def test_cached_task_reuses_output(self):
+        """
+        test cached outputs depend on input and the outputs a task reads
+        """
+        task_manager = TaskManager()
+        calls = []
+
+        @task_manager.task(uses_output=False)
+        def source(value, **kwargs):
+            return value
+
+        @task_manager.task(cache=True)
+        def expensive(get_output_for, value, factor):
+            calls.append(value)
+            return get_output_for("source") * factor
+
+        def run(value, factor):
+            context = task_manager.new_context()
+            context.run_tasks(["source", "expensive"], value=value, factor=factor)
+            return context.get_output_for("expensive")
+
+        self.assertEqual(run(2, 3), 6)
+        self.assertEqual(run(2, 3), 6)
+        self.assertEqual(calls, [2])
+        # changed upstream output and changed input are both misses
+        self.assertEqual(run(4, 3), 12)
+        self.assertEqual(run(4, 5), 20)
+        self.assertEqual(calls, [2, 4, 4])
+        self.assertEqual(task_manager.cache.hits, 1)
+
+    def test_memory_cache_eviction(self):
+        """
+        test least recently used entries are evicted by count and size
+        """
+        cache = MemoryCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache = MemoryCache(max_entries=None, max_bytes=2500)
+        cache.set("a", b"x" * 1000)
+        cache.set("b", b"x" * 1000)
+        cache.set("c", b"x" * 1000)
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn("a", cache)
+        self.assertLessEqual(cache.size, 2500)
+
+    def test_disk_cache_is_shared_between_instances(self):
+        """
+        test disk cache entries survive new instances and expire
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            calls = []
+
+            def build():
+                task_manager = TaskManager(cache=DiskCache(directory))
+
+                @task_manager.task(uses_output=False, cache=True)
+                def expensive(value):
+                    calls.append(value)
+                    return {"value": value}
+
+                return task_manager
+
+            task_manager = build()
+            task_manager.new_context().run_tasks(["expensive"], value=1)
+            task_manager.cache.close()
+            task_manager = build()
+            context = task_manager.new_context().run_tasks(["expensive"], value=1)
+            self.assertEqual(context.get_output_for("expensive"), {"value": 1})
+            self.assertEqual(calls, [1])
+            self.assertEqual(task_manager.cache.stats()["hits"], 1)
+            task_manager.cache.close()
+
+            with DiskCache(directory, ttl=0) as cache:
+                cache.set("key", "value")
+                self.assertNotIn("key", cache)
+                self.assertEqual(cache.get("key", None), None)
+
+    def test_disk_cache_is_shared_between_processes(self):
+        """
+        test entries written concurrently by two processes are read by
+        a third one
+        """
+        keys = [f"key{i}" for i in range(50)]
+        with tempfile.TemporaryDirectory() as directory:
+            with concurrent.futures.ProcessPoolExecutor(
+                2, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                writes = [
+                    pool.submit(write_disk_cache, directory, keys[i::2])
+                    for i in range(2)
+                ]
+                for write in writes:
+                    write.result()
+                values = pool.submit(read_disk_cache, directory, keys).result()
+            self.assertEqual(values, [{"key": key} for key in keys])
+            with DiskCache(directory) as cache:
+                self.assertEqual(len(cache), len(keys))
+
+    def test_disk_cache_eviction(self):
+        """
+        test least recently used disk cache entries are evicted
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            with DiskCache(directory, max_entries=2) as cache:
+                cache.set("a", 1)
+                cache.set("b", 2)
+                cache.get("a")
+                cache.set("c", 3)
+                self.assertIn("a", cache)
+                self.assertNotIn("b", cache)
+                self.assertEqual(len(cache), 2)
+
+    def test_resume_interrupted_run(self):
+        """
+        test resume skips tasks which succeeded before the crash
+        """
+
+        class Crash(BaseException):
+            """
+            simulates the process being killed, not caught by rollback
+            """
+
+        with tempfile.TemporaryDirectory() as directory:
+            calls = []
+
+            def build(crash):
+                task_manager = TaskManager(journal=Journal(directory))
+
+                @task_manager.task(uses_output=False)
+                def first():
+                    calls.append("first")
+                    return {"rows": 3}
+
+                @task_manager.task()
+                def second(get_output_for):
+                    calls.append("second")
+                    if crash:
+                        raise Crash()
+                    return get_output_for("first")["rows"] * 2
+
+                return task_manager
+
+            context = build(crash=True).new_context()
+            with self.assertRaises(Crash):
+                context.run_tasks(["first", "second"])
+
+            resumed = build(crash=False).resume(context.run_id)
+            self.assertEqual(resumed.get_output_for("second"), 6)
+            self.assertEqual(calls, ["first", "second", "second"])
+
+    def test_rolled_back_run_cannot_be_resumed(self):
+        """
+        test runs which failed and rolled back are not resumed
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            task_manager = TaskManager(journal=Journal(directory))
+
+            @task_manager.task(uses_output=False)
+            def fails():
+                raise ValueError("fails")
+
+            context = task_manager.new_context()
+            with self.assertRaises(TaskFailedError):
+                context.run_tasks(["fails"])
+            with self.assertRaises(Exception):
+                task_manager.resume(context.run_id)
+
+    def test_completed_runs_delete_their_journal(self):
+        """
+        test journals are deleted once a run succeeded or rolled back and
+        later runs of the context can still be resumed
+        """
+
+        class Crash(BaseException):
+            """
+            simulates the process being killed, not caught by rollback
+            """
+
+        with tempfile.TemporaryDirectory() as directory:
+            calls = []
+            crash = [False]
+            task_manager = TaskManager(journal=Journal(directory))
+
+            @task_manager.task(uses_output=False)
+            def first():
+                calls.append("first")
+                return 3
+
+            # reads first without depends_on, like most tasks do
+            @task_manager.task()
+            def second(get_output_for):
+                calls.append("second")
+                if crash[0]:
+                    raise Crash()
+                return get_output_for("first") * 2
+
+            @task_manager.task(uses_output=False)
+            def fails():
+                raise ValueError("fails")
+
+            context = task_manager.new_context().run_tasks(["first"])
+            self.assertEqual(os.listdir(directory), [])
+            crash[0] = True
+            with self.assertRaises(Crash):
+                context.run_tasks(["second"])
+            crash[0] = False
+            # first succeeded in the completed run, it is not run again
+            resumed = task_manager.resume(context.run_id)
+            self.assertEqual(resumed.get_output_for("second"), 6)
+            self.assertEqual(calls, ["first", "second", "second"])
+            self.assertEqual(os.listdir(directory), [])
+
+            with self.assertRaises(TaskFailedError):
+                task_manager.new_context().run_tasks(["fails"])
+            self.assertEqual(os.listdir(directory), [])
+
+            task_manager.journal = Journal(directory, keep_completed=True)
+            context = task_manager.new_context().run_tasks(["first"])
+            self.assertTrue(task_manager.journal.load(context.run_id).completed)
+
+    def test_parallel_rollback_in_reverse_dependency_order(self):
+        """
+        test independent rollbacks overlap and upstream rollbacks run last
+        """
+        task_manager = TaskManager(rollback_workers=2)
+        barrier = threading.Barrier(2, timeout=5)
+        rolled_back = []
+
+        def make(name, depends_on, fails=False):
+            def rollback():
+                if name in ("left", "right"):
+                    # both must be rolled back at the same time to pass
+                    barrier.wait()
+                rolled_back.append(name)
+
+            def action():
+                if fails:
+                    raise ValueError("fails")
+                return name
+
+            action.__name__ = name
+            rollback.__name__ = f"{name}_rollback"
+            task_manager.register_task(
+                action,
+                uses_output=False,
+                depends_on=depends_on,
+                rollback=rollback,
+                rollback_uses_output=False,
+            )
+
+        make("root", [])
+        make("left", ["root"])
+        make("right", ["root"])
+        make("sink", ["left", "right"], fails=True)
+
+        with self.assertRaises(TaskFailedError):
+            task_manager.run_tasks_parallel(["root", "left", "right", "sink"])
+        self.assertEqual(sorted(rolled_back[:2]), ["left", "right"])
+        self.assertEqual(rolled_back[2:], ["root"])
+
+    def test_instrumented_timings(self):
+        """
+        test instrumented runs record timings of tasks and rollbacks
+        """
+        task_manager = TaskManager(instrument=True)
+
+        def first_rollback():
+            time.sleep(0.01)
+
+        @task_manager.task(
+            uses_output=False, rollback=first_rollback, rollback_uses_output=False
+        )
+        def first():
+            time.sleep(0.02)
+
+        @task_manager.task(uses_output=False)
+        def second():
+            raise ValueError("fails")
+
+        with self.assertRaises(TaskFailedError):
+            task_manager.run_tasks(["first", "second"])
+        result = task_manager.get_result()
+        self.assertEqual(set(result.timings), {"first", "second", "first_rollback"})
+        self.assertGreaterEqual(result.timings["first"].wall, 0.02)
+        self.assertLess(result.timings["first"].cpu, 0.02)
+        self.assertGreaterEqual(
+            result.timings["first_rollback"].started, result.timings["second"].finished
+        )
+        aggregate = result.aggregate()
+        self.assertEqual(aggregate["tasks"], 3)
+        self.assertEqual(aggregate["slowest"][0], "first")
+
+    def test_timings_of_timed_tasks_measure_their_thread(self):
+        """
+        test the CPU time of a task with a timeout is measured in the
+        thread running its action
+        """
+        task_manager = TaskManager(instrument=True)
+
+        @task_manager.task(uses_output=False, timeout=5)
+        def busy():
+            started = time.thread_time()
+            while time.thread_time() - started < 0.05:
+                pass
+
+        task_manager.run_tasks(["busy"])
+        self.assertGreaterEqual(task_manager.get_result().timings["busy"].cpu, 0.05)
+
+    def test_timings_are_not_recorded_by_default(self):
+        """
+        test timings are empty unless the task manager instruments
+        """
+        task_manager = TaskManager()
+
+        @task_manager.task(uses_output=False)
+        def first():
+            return 1
+
+        task_manager.run_tasks(["first"])
+        self.assertEqual(task_manager.get_result().timings, {})
+
+    def test_chrome_trace_export(self):
+        """
+        test trace has a span per task and flows from upstream tasks
+        """
+        task_manager = TaskManager(instrument=True)
+
+        @task_manager.task(uses_output=False)
+        def fetch():
+            return 1
+
+        @task_manager.task(depends_on=["fetch"])
+        def aggregate(get_output_for):
+            return get_output_for("fetch")
+
+        task_manager.run_tasks_parallel(["fetch", "aggregate"])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            task_manager.get_result().write_chrome_trace(path)
+            with open(path, encoding="utf-8") as f:
+                events = json.load(f)["traceEvents"]
+
+        spans = {e["name"]: e for e in events if e["ph"] == "X"}
+        self.assertEqual(set(spans), {"fetch", "aggregate"})
+        self.assertGreaterEqual(
+            spans["aggregate"]["ts"], spans["fetch"]["ts"] + spans["fetch"]["dur"]
+        )
+        flows = [e for e in events if e["ph"] in ("s", "f")]
+        self.assertEqual(
+            [e["tid"] for e in flows],
+            [spans["fetch"]["tid"], spans["aggregate"]["tid"]],
+        )
+
+    def test_task_flags_and_result_as_dict(self):
+        """
+        test packed task flags, state statuses and result as_dict
+        """
+        task_manager = TaskManager()
+
+        @task_manager.task(uses_output=False, rollback_uses_output=False, cache=True)
+        def first():
+            return 1
+
+        @task_manager.task()
+        def second(get_output_for):
+            raise ValueError("fails")
+
+        task = task_manager.tasks["first"]
+        self.assertFalse(hasattr(task, "__dict__"))
+        self.assertEqual(
+            (task.uses_output(), task.rollback_uses_output(), task.uses_cache()),
+            (False, False, True),
+        )
+        self.assertEqual((task.has_run(), task.is_success()), (False, None))
+        with self.assertRaises(TaskFailedError):
+            task_manager.run_tasks(["first", "second"])
+        self.assertEqual((task.has_run(), task.is_success()), (True, True))
+        failed = task_manager.tasks["second"]
+        self.assertEqual((failed.has_run(), failed.is_success()), (True, False))
+        result = task_manager.get_result().as_dict()
+        self.assertEqual(result["tasks_success"], ["first"])
+        self.assertEqual(result["tasks_failed"], ["second"])
+        self.assertEqual(
+            set(result),
+            {
+                "tasks_success",
+                "tasks_failed",
+                "exceptions",
+                "timings",
+                "rollback_tasks",
+                "dependencies",
+                "peak_output_bytes",
+            },
+        )
+
+    def test_flush_tasks_starts_new_generation(self):
+        """
+        test flushed states read as not run and can be run again
+        """
+        task_manager = TaskManager(instrument=True)
+        calls = []
+
+        @task_manager.task(uses_output=False)
+        def first():
+            calls.append("first")
+            return len(calls)
+
+        context = task_manager.new_context()
+        context.run_tasks(["first"])
+        task_manager.run_tasks(["first"])
+        task_manager.flush_tasks()
+        task = task_manager.tasks["first"]
+        self.assertEqual(
+            (task.has_run(), task.is_success(), task.get_output()), (False, None, None)
+        )
+        self.assertIsNone(task.state.timing)
+        self.assertEqual(task_manager.get_result().tasks_success, [])
+        # other contexts keep their state
+        self.assertEqual(context.get_output_for("first"), 1)
+        task_manager.run_tasks(["first"])
+        self.assertEqual(task_manager.get_output_for("first"), 3)
+        self.assertEqual(task_manager.get_result().tasks_success, ["first"])
+
+    def test_get_outputs_runs_only_required_tasks(self):
+        """
+        test only the dependency closure of the requested tasks runs
+        """
+        task_manager = TaskManager()
+        calls = []
+
+        def make_task(name, depends_on):
+            def function(get_output_for):
+                calls.append(name)
+                return sum(get_output_for(d) for d in depends_on) + 1
+
+            function.__name__ = name
+            task_manager.register_task(function, depends_on=depends_on)
+
+        make_task("source", [])
+        make_task("left", ["source"])
+        make_task("right", ["source"])
+        make_task("report", ["left", "right"])
+        make_task("unrelated", ["source"])
+
+        self.assertEqual(task_manager.get_outputs(["report"]), {"report": 5})
+        self.assertEqual(sorted(calls), ["left", "report", "right", "source"])
+        # succeeded tasks are not run again
+        self.assertEqual(task_manager.get_outputs(["unrelated"]), {"unrelated": 2})
+        self.assertEqual(calls.count("source"), 1)
+        with self.assertRaises(Exception):
+            task_manager.get_outputs(["missing"])
+
+    def test_inferred_dependencies_parallelize_next_run(self):
+        """
+        test reads recorded by run_tasks() order a later parallel run
+        """
+
+        def register(task_manager):
+            @task_manager.task(uses_output=False)
+            def source():
+                time.sleep(0.02)
+                return 2
+
+            @task_manager.task()
+            def double(get_output_for):
+                return get_output_for("source") * 2
+
+            @task_manager.task()
+            def report(get_output_for):
+                return get_output_for("double") + get_output_for("source")
+
+        task_manager = TaskManager(infer_dependencies=True)
+        register(task_manager)
+        task_manager.run_tasks(["source", "double", "report"])
+        self.assertEqual(
+            task_manager.inferred_dependencies,
+            {"double": ("source",), "report": ("double", "source")},
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "dependencies.json")
+            task_manager.save_inferred_dependencies(path)
+            loaded = TaskManager()
+            register(loaded)
+            loaded.load_inferred_dependencies(path)
+        loaded.run_tasks_parallel(["report", "double", "source"])
+        self.assertEqual(loaded.get_output_for("report"), 6)
+        self.assertEqual(loaded.get_outputs(["double"]), {"double": 4})
+
+    def test_undeclared_dependency_waits_in_parallel_run(self):
+        """
+        test reading an unfinished scheduled task runs it instead of failing
+        """
+        task_manager = TaskManager(max_workers=1, infer_dependencies=True)
+
+        @task_manager.task()
+        def consumer(get_output_for):
+            return get_output_for("producer") + 1
+
+        @task_manager.task(uses_output=False)
+        def producer():
+            return 1
+
+        @task_manager.task()
+        def first(get_output_for):
+            return get_output_for("second")
+
+        @task_manager.task()
+        def second(get_output_for):
+            return get_output_for("first")
+
+        task_manager.run_tasks_parallel(["consumer", "producer"])
+        self.assertEqual(task_manager.get_output_for("consumer"), 2)
+        self.assertEqual(task_manager.inferred_dependencies["consumer"], ("producer",))
+        with self.assertRaises(TaskFailedError):
+            task_manager.new_context().run_tasks_parallel(["first", "second"])
+
+    def test_readers_do_not_run_process_tasks_inline(self):
+        """
+        test a process task claimed by a task reading its output still
+        runs in a worker process
+        """
+        for options in ({"infer_dependencies": True}, {"eager": True}):
+            task_manager = TaskManager(max_workers=1, max_processes=1, **options)
+
+            @task_manager.task()
+            def reader(get_output_for, value):
+                return get_output_for("process_id")
+
+            task_manager.register_task(square, uses_output=False, executor="process")
+            task_manager.register_task(
+                process_id, depends_on=["square"], executor="process"
+            )
+            task_manager.run_tasks_parallel(["reader", "square", "process_id"], value=3)
+            pid, squared = task_manager.get_output_for("reader")
+            self.assertNotEqual(pid, os.getpid())
+            self.assertEqual(squared, 9)
+
+    def test_eager_tasks_overlap_with_upstream(self):
+        """
+        test eager tasks start before their upstream tasks finished
+        """
+        task_manager = TaskManager(max_workers=2, eager=True)
+        consumer_started = threading.Event()
+
+        @task_manager.task(uses_output=False)
+        def producer():
+            # only returns True when consumer is already running
+            return consumer_started.wait(5)
+
+        @task_manager.task(depends_on=["producer"])
+        def consumer(get_output_for):
+            consumer_started.set()
+            return get_output_for("producer")
+
+        task_manager.run_tasks_parallel(["producer", "consumer"])
+        self.assertIs(task_manager.get_output_for("consumer"), True)
+
+    def test_get_output_for_timeout(self):
+        """
+        test waiting for an unfinished task gives up after the timeout
+        """
+        task_manager = TaskManager(max_workers=2, eager=True)
+        slow_started = threading.Event()
+
+        @task_manager.task(uses_output=False)
+        def slow():
+            slow_started.set()
+            time.sleep(0.2)
+            return 1
+
+        @task_manager.task()
+        def impatient(get_output_for):
+            slow_started.wait(5)
+            return get_output_for("slow", timeout=0.01)
+
+        with self.assertRaises(TaskFailedError) as error:
+            task_manager.run_tasks_parallel(["slow", "impatient"])
+        self.assertIsInstance(error.exception.__cause__, OutputNotAvailableError)
+
+    def test_eager_coroutines_wait_for_outputs(self):
+        """
+        test eager coroutines start right away and await what they read
+        """
+        task_manager = TaskManager(eager=True, output_timeout=5)
+        order = []
+
+        @task_manager.task(uses_output=False)
+        async def producer():
+            await asyncio.sleep(0.02)
+            order.append("producer")
+            return 1
+
+        @task_manager.task(depends_on=["producer"])
+        async def consumer(get_output_for):
+            order.append("consumer")
+            return await get_output_for("producer") + 1
+
+        asyncio.run(task_manager.run_tasks_async(["producer", "consumer"]))
+        self.assertEqual(order, ["consumer", "producer"])
+        self.assertEqual(task_manager.get_output_for("consumer"), 2)
+
+    def test_release_outputs_after_last_consumer(self):
+        """
+        test intermediate outputs are dropped once their readers succeeded
+        """
+
+        def register(task_manager):
+            @task_manager.task(uses_output=False)
+            def load():
+                return bytearray(100000)
+
+            @task_manager.task(depends_on=["load"])
+            def clean(get_output_for):
+                return bytearray(len(get_output_for("load")))
+
+            @task_manager.task(depends_on=["clean"])
+            def transform(get_output_for):
+                return bytearray(len(get_output_for("clean")))
+
+            @task_manager.task(depends_on=["transform"], retain_output=True)
+            def summary(get_output_for):
+                return len(get_output_for("transform"))
+
+            @task_manager.task(depends_on=["summary"])
+            def report(get_output_for):
+                return get_output_for("summary")
+
+        peaks = []
+        for release_outputs in (False, True):
+            task_manager = TaskManager(release_outputs=release_outputs, instrument=True)
+            register(task_manager)
+            task_manager.run_tasks(["load", "clean", "transform", "summary", "report"])
+            self.assertEqual(task_manager.get_output_for("report"), 100000)
+            peaks.append(task_manager.get_result().peak_output_bytes)
+
+        # all three intermediate outputs vs. at most two at a time
+        self.assertGreater(peaks[0], 300000)
+        self.assertLess(peaks[1], 201000)
+        with self.assertRaises(OutputNotAvailableError):
+            task_manager.get_output_for("load")
+        self.assertTrue(task_manager.tasks["load"].is_success())
+        self.assertEqual(task_manager.get_output_for("summary"), 100000)
+
+    def test_release_outputs_keeps_outputs_rollbacks_and_callers_read(self):
+        """
+        test outputs read by rollback tasks and outputs requested with
+        get_outputs() are not released
+        """
+        task_manager = TaskManager(release_outputs=True)
+        rolled_back = []
+
+        @task_manager.task(uses_output=False)
+        def create_bucket():
+            return "bucket"
+
+        def upload_rollback(get_output_for):
+            rolled_back.append(get_output_for("create_bucket"))
+
+        @task_manager.task(depends_on=["create_bucket"], rollback=upload_rollback)
+        def upload(get_output_for):
+            return f"{get_output_for('create_bucket')}/file"
+
+        @task_manager.task(depends_on=["upload"])
+        def notify(get_output_for):
+            raise ValueError("notification failed")
+
+        with self.assertRaises(TaskFailedError) as failure:
+            task_manager.run_tasks(["create_bucket", "upload", "notify"])
+        self.assertIn("'notify'", str(failure.exception))
+        self.assertEqual(rolled_back, ["bucket"])
+
+        task_manager = TaskManager(release_outputs=True)
+
+        @task_manager.task(uses_output=False)
+        def load():
+            return [1, 2, 3]
+
+        @task_manager.task(depends_on=["load"])
+        def total(get_output_for):
+            return sum(get_output_for("load"))
+
+        self.assertEqual(
+            task_manager.get_outputs(["load", "total"]), {"load": [1, 2, 3], "total": 6}
+        )
+        context = task_manager.new_context()
+        self.assertEqual(context.get_outputs(["total"]), {"total": 6})
+        self.assertTrue(context._states["load"].is_released())
+        # a released output is computed again when it is requested
+        self.assertEqual(context.get_outputs(["load"]), {"load": [1, 2, 3]})
+
+    def test_spill_outputs_over_budget(self):
+        """
+        test largest outputs are spilled to files and read back
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            store = SpillStore(max_bytes=150000, directory=directory)
+            task_manager = TaskManager(spill=store)
+
+            @task_manager.task(uses_output=False)
+            def large():
+                return bytearray(b"x" * 100000)
+
+            @task_manager.task(uses_output=False)
+            def larger():
+                return {"data": bytearray(b"y" * 120000)}
+
+            @task_manager.task(depends_on=["large", "larger"])
+            def total(get_output_for):
+                return len(get_output_for("large")) + len(
+                    get_output_for("larger")["data"]
+                )
+
+            task_manager.run_tasks(["large", "larger", "total"])
+            self.assertEqual(task_manager.get_output_for("total"), 220000)
+            self.assertEqual(store.spills, 1)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(
+                task_manager.get_output_for("larger")["data"], b"y" * 120000
+            )
+            self.assertEqual(task_manager.get_output_for("large"), b"x" * 100000)
+            self.assertTrue(task_manager.tasks["larger"].is_success())
+
+            task_manager.flush_tasks()
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(store.size, 0)
+
+    @unittest.skipIf(sys.version_info < (3, 8), "shared memory requires Python 3.8")
+    def test_shared_memory_outputs_for_process_tasks(self):
+        """
+        test large outputs reach process tasks through shared memory
+        """
+        task_manager = TaskManager(max_processes=1, shared_memory=1024)
+
+        @task_manager.task(uses_output=False, executor="inline")
+        def blob():
+            return bytearray(b"x" * 100000)
+
+        @task_manager.task(uses_output=False, executor="inline")
+        def raw():
+            return b"y" * 100000
+
+        @task_manager.task(uses_output=False, executor="inline")
+        def numbers():
+            return array.array("d", range(1000))
+
+        task_manager.register_task(
+            summarize_outputs,
+            depends_on=["blob", "raw", "numbers"],
+            executor="process",
+        )
+        shm = "/dev/shm"
+        before = set(os.listdir(shm)) if os.path.isdir(shm) else set()
+        task_manager.run_tasks_parallel(["blob", "raw", "numbers", "summarize_outputs"])
+        self.assertEqual(
+            task_manager.get_output_for("summarize_outputs"),
+            [("bytearray", 100000), ("bytes", 100000), ("array", 1000)],
+        )
+        if os.path.isdir(shm):
+            # segments are unlinked when the run ends
+            self.assertEqual(set(os.listdir(shm)) - before, set())
+
+    def test_run_many_isolates_inputs(self):
+        """
+        test run_many runs a plan per input with bounded concurrency and
+        rolls back failing inputs only
+        """
+        task_manager = TaskManager()
+        rolled_back = []
+        lock = threading.Lock()
+        running = [0, 0]  # current, highest
+
+        def parse_rollback(record):
+            rolled_back.append(record)
+
+        @task_manager.task(
+            uses_output=False, rollback=parse_rollback, rollback_uses_output=False
+        )
+        def parse(record):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+            return int(record)
+
+        @task_manager.task()
+        def store(get_output_for, record):
+            if record == "3":
+                raise ValueError(record)
+            return get_output_for("parse") * 10
+
+        read = []
+
+        def records():
+            for record in ["1", "2", "3", "4", "5", "6"]:
+                read.append(record)
+                yield {"record": record}
+
+        outcomes = task_manager.run_many(["parse", "store"], records(), concurrency=2)
+        first = next(outcomes)
+        # inputs are read lazily
+        self.assertLessEqual(len(read), 3)
+        outcomes = [first] + list(outcomes)
+        self.assertEqual(len(outcomes), 6)
+        self.assertLessEqual(running[1], 2)
+        failed = [o for o in outcomes if o.exception is not None]
+        self.assertEqual([o.position for o in failed], [2])
+        self.assertIsInstance(failed[0].exception, TaskFailedError)
+        self.assertEqual(rolled_back, ["3"])
+        self.assertEqual(
+            sorted(
+                o.context.get_output_for("store")
+                for o in outcomes
+                if o.exception is None
+            ),
+            [10, 20, 40, 50, 60],
+        )
+        with self.assertRaises(ValueError):
+            list(task_manager.run_many(["parse"], [], concurrency=0))
+
+    def test_batchable_task_coalesces_concurrent_runs(self):
+        """
+        test calls of a batchable task by concurrent runs are made in
+        batches and every run gets its own output or exception
+        """
+        task_manager = TaskManager()
+        batches = []
+
+        @task_manager.task(uses_output=False)
+        def load(value):
+            return value
+
+        @task_manager.task(batchable=True, batch_size=4, batch_window=0.5)
+        def score(batch):
+            batches.append(len(batch))
+            return [
+                ValueError("negative")
+                if item["value"] < 0
+                else item["get_output_for"]("load") * 2
+                for item in batch
+            ]
+
+        outcomes = task_manager.run_many(
+            ["load", "score"], ({"value": v} for v in range(8)), concurrency=8
+        )
+        self.assertEqual(
+            sorted(o.context.get_output_for("score") for o in outcomes),
+            [0, 2, 4, 6, 8, 10, 12, 14],
+        )
+        self.assertEqual(batches, [4, 4])
+        self.assertTrue(task_manager.tasks["score"].batchable())
+
+        async def run_async(value):
+            context = task_manager.new_context()
+            await context.run_tasks_async(["load", "score"], value=value)
+            return context.get_output_for("score")
+
+        async def run_all():
+            return await asyncio.gather(
+                run_async(1), run_async(-1), return_exceptions=True
+            )
+
+        batches.clear()
+        outputs = asyncio.run(run_all())
+        # the bad input only fails its own run
+        self.assertEqual(batches, [2])
+        self.assertEqual(outputs[0], 2)
+        self.assertIsInstance(outputs[1], TaskFailedError)
+        self.assertIsInstance(outputs[1].__cause__, ValueError)
+
+        with self.assertRaises(ValueError):
+            task_manager.register_task(load, batchable=True, executor="process")
+
+    def test_single_flight_shares_in_flight_calls(self):
+        """
+        test concurrent runs calling a single-flight task with the same
+        input share one call, its output and its exception
+        """
+        task_manager = TaskManager()
+        calls = []
+
+        @task_manager.task(uses_output=False, single_flight=True)
+        def fetch_config(env):
+            calls.append(env)
+            if env == "broken":
+                raise ValueError(env)
+            time.sleep(0.2)
+            return {"env": env}
+
+        outcomes = list(
+            task_manager.run_many(
+                ["fetch_config"],
+                [{"env": "prod"}] * 4 + [{"env": "dev"}],
+                concurrency=5,
+            )
+        )
+        outputs = [o.context.get_output_for("fetch_config") for o in outcomes]
+        self.assertEqual(sorted(calls), ["dev", "prod"])
+        self.assertEqual(len([o for o in outputs if o == {"env": "prod"}]), 4)
+        prod = [o for o in outputs if o["env"] == "prod"]
+        self.assertTrue(all(o is prod[0] for o in prod))
+        self.assertEqual(task_manager.tasks["fetch_config"].action.flights.shared, 3)
+
+        calls.clear()
+        outcomes = list(
+            task_manager.run_many(
+                ["fetch_config"], [{"env": "broken"}] * 2, concurrency=2
+            )
+        )
+        self.assertTrue(all(o.exception is not None for o in outcomes))
+        # the calls ran one after another or shared the exception
+        self.assertLessEqual(len(calls), 2)
+
+        @task_manager.task(uses_output=False, single_flight=True)
+        async def fetch_async(env):
+            calls.append(env)
+            await asyncio.sleep(0.1)
+            return env.upper()
+
+        async def run_all():
+            contexts = [task_manager.new_context() for _ in range(3)]
+            await asyncio.gather(
+                *(c.run_tasks_async(["fetch_async"], env="qa") for c in contexts)
+            )
+            return [c.get_output_for("fetch_async") for c in contexts]
+
+        calls.clear()
+        self.assertEqual(asyncio.run(run_all()), ["QA"] * 3)
+        self.assertEqual(calls, ["qa"])
+
+    def test_task_timeout_rolls_back_promptly(self):
+        """
+        test a task running longer than its timeout fails with
+        TaskTimeoutError in every execution mode and the run rolls back
+        """
+        task_manager = TaskManager()
+        rolled_back = []
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def prepare_rollback():
+            rolled_back.append("prepare")
+
+        @task_manager.task(
+            uses_output=False, rollback=prepare_rollback, rollback_uses_output=False
+        )
+        def prepare():
+            return 1
+
+        @task_manager.task(uses_output=False, timeout=0.2)
+        def hang():
+            release.wait(30)
+
+        for run in (task_manager.run_tasks, task_manager.run_tasks_parallel):
+            task_manager.flush_tasks()
+            started = time.perf_counter()
+            with self.assertRaises(TaskFailedError):
+                run(["prepare", "hang"])
+            self.assertLess(time.perf_counter() - started, 5)
+            self.assertIsInstance(
+                task_manager.tasks["hang"].get_exception(), TaskTimeoutError
+            )
+            self.assertEqual(rolled_back, ["prepare"])
+            rolled_back.clear()
+
+        cancelled = []
+
+        @task_manager.task(uses_output=False, timeout=0.2)
+        async def hang_async():
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        task_manager.flush_tasks()
+        with self.assertRaises(TaskFailedError):
+            asyncio.run(task_manager.run_tasks_async(["prepare", "hang_async"]))
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(rolled_back, ["prepare"])
+
+        task_manager.register_task(
+            hang_in_process, uses_output=False, executor="process", timeout=1
+        )
+        for run in ("run_tasks_parallel", "run_tasks"):
+            with tempfile.TemporaryDirectory() as directory:
+                pid_file = os.path.join(directory, "pid")
+                context = task_manager.new_context()
+                with self.assertRaises(TaskFailedError):
+                    getattr(context, run)(["hang_in_process"], pid_file=pid_file)
+                self.assertIsInstance(
+                    context.get_result().exceptions[0], TaskTimeoutError
+                )
+                with open(pid_file, "r", encoding="utf-8") as f:
+                    pid = int(f.read())
+                # the process has been terminated
+                with self.assertRaises(ProcessLookupError):
+                    os.kill(pid, 0)
+
+    def test_run_timeout_fails_remaining_tasks(self):
+        """
+        test tasks still running at the deadline of the run fail and
+        later runs get a deadline of their own
+        """
+        task_manager = TaskManager(run_timeout=0.3)
+        rolled_back = []
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def fetch_rollback():
+            rolled_back.append("fetch")
+
+        @task_manager.task(
+            uses_output=False, rollback=fetch_rollback, rollback_uses_output=False
+        )
+        def fetch(slow=False):
+            if slow:
+                release.wait(30)
+            return "data"
+
+        @task_manager.task()
+        def store(get_output_for, slow=False):
+            return get_output_for("fetch")
+
+        context = task_manager.new_context()
+        with self.assertRaises(TaskFailedError):
+            context.run_tasks(["fetch", "store"], slow=True)
+        self.assertIsInstance(context.get_result().exceptions[0], TaskTimeoutError)
+        self.assertEqual(rolled_back, [])
+
+        time.sleep(0.3)
+        outcomes = list(task_manager.run_many(["fetch", "store"], [{}, {}]))
+        self.assertEqual(
+            [o.context.get_output_for("store") for o in outcomes], ["data", "data"]
+        )
+
+    @unittest.skipIf(sys.version_info < (3, 8), "shared memory requires Python 3.8")
+    def test_shared_memory_segments_closed_after_process_task(self):
+        """
+        test outputs keeping views of their shared memory segments (like
+        NumPy arrays) are read in process tasks and the segments are
+        closed once the task returned
+        """
+        task_manager = TaskManager(max_processes=1, shared_memory=1024)
+
+        @task_manager.task(uses_output=False, executor="inline")
+        def view():
+            return BufferView(bytearray(100000))
+
+        task_manager.register_task(
+            buffer_view_size, depends_on=["view"], executor="process"
+        )
+        task_manager.run_tasks_parallel(["view", "buffer_view_size"])
+        self.assertEqual(task_manager.get_output_for("buffer_view_size"), 100000)
+
+        # what a worker process does with the handed over output
+        shared, segments = share(BufferView(bytearray(100000)), 1024)
+        self.assertIsInstance(shared, SharedOutput)
+        handle = pickle.loads(pickle.dumps(shared))
+        unraisable = []
+        hook = sys.unraisablehook
+        sys.unraisablehook = unraisable.append
+        try:
+            output = handle.load()
+            # the view is still in use, closing is retried later
+            handle.close()
+            self.assertEqual(output.data.nbytes, 100000)
+            del output
+            gc.collect()
+        finally:
+            sys.unraisablehook = hook
+            release_segments(segments)
+        self.assertEqual(unraisable, [])